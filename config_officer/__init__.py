@@ -5,6 +5,7 @@
 
 This plugin is available only for Cisco devices as for now."""
 
+import sys
 from extras.plugins import PluginConfig
 
 
@@ -21,5 +22,14 @@ class NetboxConfigOfficer(PluginConfig):
     base_url = "config_officer"
     caching_config = {}
 
+    def ready(self):
+        super().ready()
+        from . import signals  # noqa: F401
+
+        # Compile TextFSM templates once per worker process, not per device
+        if "rqworker" in sys.argv:
+            from .collect import warm_parsers
+            warm_parsers()
+
 
 config = NetboxConfigOfficer
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from config_officer.models import Collection
+from config_officer.models import Collection, CollectionRun, ConfigChange
 
 
 class CollectionSerializer(serializers.ModelSerializer):
@@ -13,4 +13,46 @@ class CollectionSerializer(serializers.ModelSerializer):
             "device",
             "status",
             "message",
-        ]
\ No newline at end of file
+        ]
+
+
+class CollectionRunSerializer(serializers.ModelSerializer):
+    """Serializer for the CollectionRun model."""
+
+    class Meta:
+        """Meta class."""
+
+        model = CollectionRun
+        fields = [
+            "id",
+            "started",
+            "finished",
+            "commit_msg",
+            "total",
+            "pending",
+            "running",
+            "succeeded",
+            "failed",
+            "throughput",
+        ]
+
+
+class ConfigChangeSerializer(serializers.ModelSerializer):
+    """Serializer for the ConfigChange model."""
+
+    class Meta:
+        """Meta class."""
+
+        model = ConfigChange
+        fields = [
+            "id",
+            "device",
+            "hostname",
+            "config_type",
+            "commit",
+            "date",
+            "message",
+            "added",
+            "deleted",
+            "run",
+        ]
@@ -1,8 +1,10 @@
 """REST API URLs for compliance."""
 
 from rest_framework import routers
-from .views import GlobalDataCollectionView
+from .views import GlobalDataCollectionView, CollectionRunView, ConfigChangeView
 
 router = routers.DefaultRouter()
 router.register(r"collection", GlobalDataCollectionView)
+router.register(r"runs", CollectionRunView)
+router.register(r"changes", ConfigChangeView)
 urlpatterns = router.urls
@@ -1,7 +1,11 @@
-from rest_framework.viewsets import ModelViewSet
-from .serializers import CollectionSerializer
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from django.db.models import Count, Sum
+from .serializers import CollectionSerializer, CollectionRunSerializer, ConfigChangeSerializer
 from django.http import HttpResponse
-from config_officer.models import Collection
+from config_officer.models import Collection, CollectionRun, ConfigChange
+from config_officer.filters import ConfigChangeFilter
 from config_officer.views import global_collection
 
 
@@ -21,3 +25,33 @@ class GlobalDataCollectionView(ModelViewSet):
     def list(self, request):
         """GET request."""
         return HttpResponse("not allowed")
+
+
+class CollectionRunView(ReadOnlyModelViewSet):
+    """Progress of global collection runs, the latest run first."""
+
+    queryset = CollectionRun.objects.all()
+    serializer_class = CollectionRunSerializer
+
+
+class ConfigChangeView(ReadOnlyModelViewSet):
+    """Fleet-wide feed of device config changes, filtered by site, role, tenant, run or time."""
+
+    queryset = ConfigChange.objects.all()
+    serializer_class = ConfigChangeSerializer
+    filterset_class = ConfigChangeFilter
+
+    @action(detail=False)
+    def devices(self, request):
+        """Changes count and changed lines summed up per device."""
+        queryset = (
+            self.filter_queryset(self.get_queryset())
+            .order_by()
+            .values("hostname", "device")
+            .annotate(changes=Count("pk"), added=Sum("added"), deleted=Sum("deleted"))
+            .order_by("-changes", "hostname")
+        )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(queryset)
@@ -3,18 +3,42 @@ from .choices import CollectFailChoices
 import pytz
 from datetime import datetime
 import os
-import socket
+import errno
+import resource
 import time
-from scrapli.driver.core import IOSXEDriver, NXOSDriver, IOSXRDriver
+import asyncio
+from scrapli.driver.core import (
+    IOSXEDriver,
+    NXOSDriver,
+    IOSXRDriver,
+    AsyncIOSXEDriver,
+    AsyncNXOSDriver,
+    AsyncIOSXRDriver,
+)
+import ntc_templates
+import textfsm
+from textfsm import clitable
 from django.conf import settings
+from asgiref.sync import sync_to_async
 import re
 from netaddr import EUI
 from dcim.choices import InterfaceTypeChoices
 from ipam.choices import IPAddressRoleChoices, IPAddressStatusChoices
-from dcim.models import Interface, DeviceType
+from dcim.models import Device, Interface, DeviceType
 from ipam.models import IPAddress, Prefix, VRF
 from dcim.fields import mac_unix_expanded_uppercase
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
+from .models import DeviceCollectionState
+from .lookup_cache import INTERFACE_TEMPLATES_CACHE, VRF_CACHE
+from .git_manager import get_config_path
+from .config_manager import normalize_config
 import importlib
+import hashlib
+import functools
+import threading
+from django.utils import timezone
 
 PLUGIN_SETTINGS = settings.PLUGINS_CONFIG.get("config_officer", dict())
 DEVICE_USERNAME = PLUGIN_SETTINGS.get("DEVICE_USERNAME", "cisco")
@@ -28,6 +52,16 @@ NETBOX_DEVICES_CONFIGS_DIR = PLUGIN_SETTINGS.get("NETBOX_DEVICES_CONFIGS_DIR", "
 TIME_ZONE = os.environ.get("TIME_ZONE", "UTC")
 NETBOX_DUAL_SIM_PLATFORM = PLUGIN_SETTINGS.get("NETBOX_DUAL_SIM_PLATFORM", "None")
 COLLECT_INTERFACES_DATA = PLUGIN_SETTINGS.get("COLLECT_INTERFACES_DATA", False)
+CUSTOM_FIELDS_SEND_SIGNALS = PLUGIN_SETTINGS.get("CUSTOM_FIELDS_SEND_SIGNALS", False)
+REACHABILITY_TIMEOUT = PLUGIN_SETTINGS.get("REACHABILITY_TIMEOUT", 20)
+REACHABILITY_CONCURRENCY = PLUGIN_SETTINGS.get("REACHABILITY_CONCURRENCY", 1000)
+REACHABILITY_PORTS = (22, 23)
+# Errors of the local host, not of the probed device: out of file descriptors, buffers or local ports
+LOCAL_SOCKET_ERRORS = {errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM, errno.EADDRNOTAVAIL}
+# File descriptors left for database, redis and git while hosts are probed
+RESERVED_FILE_DESCRIPTORS = 100
+# Pull the full running config only if change marker differs from the stored one
+INCREMENTAL_COLLECTION = PLUGIN_SETTINGS.get("INCREMENTAL_COLLECTION", False)
 REGEX_IP = '\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}'
 
 PLATFORMS = {
@@ -35,6 +69,291 @@ PLATFORMS = {
     "nxos": NXOSDriver,
     "iosxr": IOSXRDriver
 }
+
+ASYNC_PLATFORMS = {
+    "iosxe": AsyncIOSXEDriver,
+    "nxos": AsyncNXOSDriver,
+    "iosxr": AsyncIOSXRDriver
+}
+
+# Sync transport -> asyncio transport
+ASYNC_TRANSPORTS = {
+    "system": "asyncssh",
+    "telnet": "asynctelnet",
+}
+
+# asyncssh doesn't read KexAlgorithms/Ciphers of ssh_config, legacy algorithms of ssh_config are enabled here
+ASYNCSSH_OPTIONS = PLUGIN_SETTINGS.get(
+    "ASYNCSSH_OPTIONS",
+    {
+        "kex_algs": [
+            "curve25519-sha256",
+            "curve25519-sha256@libssh.org",
+            "ecdh-sha2-nistp256",
+            "ecdh-sha2-nistp384",
+            "ecdh-sha2-nistp521",
+            "diffie-hellman-group-exchange-sha256",
+            "diffie-hellman-group14-sha256",
+            "diffie-hellman-group16-sha512",
+            "diffie-hellman-group-exchange-sha1",
+            "diffie-hellman-group14-sha1",
+            "diffie-hellman-group1-sha1",
+        ],
+        "encryption_algs": [
+            "aes128-gcm@openssh.com",
+            "aes256-gcm@openssh.com",
+            "aes128-ctr",
+            "aes192-ctr",
+            "aes256-ctr",
+            "aes128-cbc",
+            "aes192-cbc",
+            "aes256-cbc",
+            "3des-cbc",
+        ],
+    },
+)
+
+SHOW_INTERFACES_COMMANDS = [
+    "show ip interface brief | include [0-9]+\.[0-9]+\.[0-9]+\.[0-9]+",
+    "show ip interface | include (VPN)|(line protocol)|(nternet address is)|(ddress determined)|(MTU is)|(Secondary address)",
+    "show interfaces | include (line protocol)|(ardware is)|(escription)",
+]
+
+# Cheap command that shows when config was changed last time, and regex to get the marker from its output.
+# Platforms without marker always pull the full running config.
+CHANGE_MARKER_COMMANDS = {
+    "iosxe": ("show running-config | include Last configuration change", r"Last configuration change.*"),
+    "iosxr": ("show configuration commit list 1", r"^\s*1\s+\S+.*$"),
+}
+
+# Precompiled line classifiers for SHOW_INTERFACES_COMMANDS outputs.
+# Alternatives are tried in order, the first matched named group is the field of DeviceInterface.
+RE_SHOW_IP_INTERFACE_BRIEF = re.compile(fr"(\S+)\s+(?:(?P<ip>{REGEX_IP})|unassigned)")
+RE_INTERFACE_HEADER = re.compile(r"(\S+)\s+is\s+.*protocol\s+is\s")
+RE_SHOW_IP_INTERFACE = re.compile(
+    fr"\s+(?:.*address\s+is\s+(?P<address>{REGEX_IP}/\d+)"
+    r"|.*determined\s+by\s+(?P<dhcp>DHCP|IPCP)"
+    r"|.*MTU\s+is\s+(?P<mtu>\d+)\s+bytes"
+    r"|VPN\s+Routing.*\"(?P<vrf>\S+)\""
+    fr"|Secondary\s+address\s+(?P<secondary>{REGEX_IP}/\d+))"
+)
+RE_SHOW_INTERFACES = re.compile(
+    r"\s+(?:Description:\s+(?P<description>.*)"
+    r"|Hardware\s+.*\(bia\s+(?P<mac>\S{14})\))"
+)
+
+# ntc-templates platform names and commands parsed with TextFSM
+TEXTFSM_PLATFORMS = {
+    "iosxe": "cisco_ios",
+    "nxos": "cisco_nxos",
+    "iosxr": "cisco_xr",
+}
+TEXTFSM_COMMANDS = [
+    ("iosxe", "show version"),
+    ("nxos", "show version"),
+]
+
+RE_IOSXR_HOSTNAME = re.compile(r'\n(.*)uptime')
+RE_IOSXR_VERSION = re.compile(r'Version\s(.*)\n')
+RE_IOSXR_PID = re.compile(r'cisco\s(.*)\sprocessor')
+
+SHOW_SIM_COMMANDS = [
+    "show controllers cellular 0 | s (^SIM [0|1])",
+]
+
+
+def get_interface_type(name):
+    """Guess NetBox interface type by interface name."""
+    if re.match(r"^FastEthernet", name, re.IGNORECASE):
+        return InterfaceTypeChoices.TYPE_100ME_FIXED
+    elif re.match(r"^GigabitEthernet", name, re.IGNORECASE):
+        return InterfaceTypeChoices.TYPE_1GE_FIXED
+    elif re.match(r"^Vlan", name, re.IGNORECASE):
+        return InterfaceTypeChoices.TYPE_VIRTUAL
+    elif re.match(r"^Loopback", name, re.IGNORECASE):
+        return InterfaceTypeChoices.TYPE_VIRTUAL
+    return InterfaceTypeChoices.TYPE_OTHER
+
+
+def save_custom_fields_bulk(devices, custom_fields):
+    """Save the same custom_field values of many devices with bulk update.
+    Device.save() is called for every device if CUSTOM_FIELDS_SEND_SIGNALS is set."""
+    for device in devices:
+        device.custom_field_data.update(custom_fields)
+    if CUSTOM_FIELDS_SEND_SIGNALS:
+        for device in devices:
+            device.save()
+    else:
+        Device.objects.bulk_update(devices, ["custom_field_data"], batch_size=1000)
+
+
+def save_custom_fields(device, custom_fields):
+    """Save custom_field values with one write.
+    Device.save() (signals, changelog, webhooks) is called only if CUSTOM_FIELDS_SEND_SIGNALS is set."""
+    device.custom_field_data.update(custom_fields)
+    if CUSTOM_FIELDS_SEND_SIGNALS:
+        device.save()
+    else:
+        Device.objects.filter(pk=device.pk).update(custom_field_data=device.custom_field_data)
+
+
+async def probe_tcp_port(host, port, timeout):
+    """Check if TCP port is open without blocking event loop.
+    Errors of the local host (i.e. out of file descriptors) are raised, they don't mean the device is unreachable."""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=timeout)
+    except asyncio.TimeoutError:
+        return False
+    except OSError as e:
+        if e.errno in LOCAL_SOCKET_ERRORS:
+            raise
+        # Connection refused, no route to host, etc.
+        return False
+    writer.close()
+    return True
+
+
+async def probe_host(host, timeout=REACHABILITY_TIMEOUT, ports=REACHABILITY_PORTS):
+    """Check if SSH or telnet port is open. All ports are probed at once, the first open port ends the check."""
+    probes = [asyncio.ensure_future(probe_tcp_port(host, port, timeout)) for port in ports]
+    try:
+        for probe in asyncio.as_completed(probes):
+            if await probe:
+                return True
+        return False
+    finally:
+        for probe in probes:
+            probe.cancel()
+
+
+def get_probe_concurrency():
+    """REACHABILITY_CONCURRENCY, capped so open sockets fit into the file descriptors limit of the process."""
+    soft_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if soft_limit == resource.RLIM_INFINITY:
+        return REACHABILITY_CONCURRENCY
+    return max(1, min(REACHABILITY_CONCURRENCY, (soft_limit - RESERVED_FILE_DESCRIPTORS) // len(REACHABILITY_PORTS)))
+
+
+async def probe_hosts(hosts, timeout=REACHABILITY_TIMEOUT):
+    """Probe list of hosts, no more than REACHABILITY_CONCURRENCY at a time."""
+    semaphore = asyncio.Semaphore(get_probe_concurrency())
+
+    async def probe(host):
+        async with semaphore:
+            return await probe_host(host, timeout)
+
+    return await asyncio.gather(*[probe(host) for host in hosts])
+
+
+def check_reachability_bulk(hosts, timeout=REACHABILITY_TIMEOUT):
+    """Get set of reachable hosts. Whole list is probed with non-blocking sockets.
+    Raises OSError if hosts can't be probed because of local errors."""
+    hosts = list(hosts)
+    results = asyncio.run(probe_hosts(hosts, timeout))
+    return {host for host, reachable in zip(hosts, results) if reachable}
+
+
+NTC_TEMPLATES_DIR = os.path.join(os.path.dirname(ntc_templates.__file__), "templates")
+
+
+def get_textfsm_template_path(platform, command):
+    """Find ntc-templates template for the platform and command in the templates index."""
+    cli_table = clitable.CliTable("index", NTC_TEMPLATES_DIR)
+    row = cli_table.index.GetRowMatch({"Platform": platform, "Command": command})
+    # Row 0 is the index header, it means no match
+    if not row:
+        return None
+    return os.path.join(NTC_TEMPLATES_DIR, cli_table.index.index[row]["Template"].split(":")[0])
+
+
+class TextFSMParser:
+    """Compiled ntc-templates TextFSM template.
+    The same object is reused for all devices, so parsing is done under lock."""
+
+    def __init__(self, platform, command):
+        template_path = get_textfsm_template_path(TEXTFSM_PLATFORMS[platform], command)
+        if template_path is None:
+            raise ValueError(f"TextFSM template not found for {platform} {command}")
+        with open(template_path) as template:
+            self.fsm = textfsm.TextFSM(template)
+        self.header = [h.lower() for h in self.fsm.header]
+        self.lock = threading.Lock()
+
+    def __call__(self, output):
+        with self.lock:
+            self.fsm.Reset()
+            rows = self.fsm.ParseText(output)
+        return [dict(zip(self.header, row)) for row in rows]
+
+
+@functools.lru_cache(maxsize=None)
+def get_textfsm_parser(platform, command):
+    """Get process-wide compiled TextFSM parser."""
+    return TextFSMParser(platform, command)
+
+
+def parse_iosxe_show_version(output):
+    parsed = get_textfsm_parser("iosxe", "show version")(output)[0]
+    return {
+        "hostname": parsed["hostname"],
+        "pid": parsed["hardware"][0],
+        "sn": parsed["serial"][0],
+        "sw": parsed["version"],
+    }
+
+
+def parse_nxos_show_version(output):
+    parsed = get_textfsm_parser("nxos", "show version")(output)[0]
+    return {
+        "hostname": parsed["hostname"],
+        "pid": parsed["platform"],
+        "sn": parsed["serial"],
+        "sw": parsed["os"],
+    }
+
+
+def parse_iosxr_show_version(output):
+    parsed = {"sn": ""}
+    r_search = RE_IOSXR_HOSTNAME.search(output)
+    if r_search:
+        parsed["hostname"] = r_search.group(1)
+    r_search = RE_IOSXR_VERSION.search(output)
+    if r_search:
+        parsed["sw"] = r_search.group(1)
+    r_search = RE_IOSXR_PID.search(output)
+    if r_search:
+        parsed["pid"] = r_search.group(1)
+    return parsed
+
+
+# (platform, command) -> function, that returns dict of CiscoDevice attributes
+PARSERS = {
+    ("iosxe", "show version"): parse_iosxe_show_version,
+    ("nxos", "show version"): parse_nxos_show_version,
+    ("iosxr", "show version"): parse_iosxr_show_version,
+}
+
+
+def warm_parsers():
+    """Compile all TextFSM templates in advance. Called when RQ worker starts."""
+    for platform, command in TEXTFSM_COMMANDS:
+        get_textfsm_parser(platform, command)
+
+
+def parse_timer(func):
+    """Add parsing time to collection task."""
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self.task.parse_time += time.perf_counter() - started
+
+    return wrapper
+
+
 class DeviceInterface:
     def __init__(self, name, **kwargs):
         self.name = name
@@ -57,110 +376,80 @@ class CiscoDevice:
         self.task = task
         self.mgmt_if = ""
         self.interfaces = {}
+        self.login_time = 0
+        self.change_marker = None
+        self.custom_fields = {}
+
+    def get_reachability_ports(self):
+        """Get TCP ports the device is reachable by."""
+        return REACHABILITY_PORTS
 
     def check_reachability(self):
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(self.device["timeout_socket"])
-                s.connect((self.device["host"], 22))
-        except Exception:
-            try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.settimeout(self.device["timeout_socket"])
-                    s.connect((self.device["host"], 23))
-            except Exception:
-                raise CollectionException(
-                    reason=CollectFailChoices.FAIL_CONNECT,
-                    message="Device unreachable",
-                )
-        time.sleep(1)
+        """Probe all ports of the device at once, so device without SSH doesn't wait for SSH port timeout."""
+        if not asyncio.run(
+            probe_host(self.device["host"], self.device["timeout_socket"], self.get_reachability_ports())
+        ):
+            raise CollectionException(
+                reason=CollectFailChoices.FAIL_CONNECT,
+                message="Device unreachable",
+            )
 
-    # Get interfaces information (IP, MTU, etc.)
-    def parse_show_interfaces(self, connection):
-        outputs = connection.send_commands(
-            [
-                "show ip interface brief | include [0-9]+\.[0-9]+\.[0-9]+\.[0-9]+",
-                "show ip interface | include (VPN)|(line protocol)|(nternet address is)|(ddress determined)|(MTU is)|(Secondary address)",
-                "show interfaces | include (line protocol)|(ardware is)|(escription)",
-            ]
-        )
+    async def check_reachability_async(self):
+        """Non-blocking variant of check_reachability for the asyncio collection mode."""
+        if not await probe_host(self.device["host"], self.device["timeout_socket"], self.get_reachability_ports()):
+            raise CollectionException(
+                reason=CollectFailChoices.FAIL_CONNECT,
+                message="Device unreachable",
+            )
 
-        ifaces = re.split(r"\n(?=\S)", outputs[0].result)
-        for iface in ifaces:
-            r = re.match(fr"^(\S+)\s+({REGEX_IP})", iface)
+    # Get interfaces information (IP, MTU, etc.)
+    @parse_timer
+    def parse_show_interfaces(self, outputs):
+        """Parse outputs of SHOW_INTERFACES_COMMANDS. Every output is parsed in a single pass."""
+        for line in outputs[0].result.splitlines():
+            r = RE_SHOW_IP_INTERFACE_BRIEF.match(line)
             if r:
-                self.interfaces.setdefault(
-                    r.group(1), DeviceInterface(name=r.group(1), ip=r.group(2))
-                )
-                if r.group(2) == self.device["host"]:
-                    self.mgmt_if = r.group(1)
-            r = re.match(fr"^(\S+)\s+(unassigned)", iface)
+                name, ip = r.group(1), r.group("ip")
+                if ip:
+                    self.interfaces.setdefault(name, DeviceInterface(name=name, ip=ip))
+                    if ip == self.device["host"]:
+                        self.mgmt_if = name
+                else:
+                    self.interfaces.setdefault(name, DeviceInterface(name=name))
+
+        for interface, field, value in self.classify_interface_lines(outputs[1].result, RE_SHOW_IP_INTERFACE):
+            if field == "dhcp":
+                interface.dhcp = True
+            elif field == "mtu":
+                interface.mtu = int(value)
+            elif field == "secondary":
+                if not hasattr(interface, "secondary"):
+                    interface.secondary = []
+                interface.secondary.append(value)
+            else:
+                setattr(interface, field, value)
+
+        for interface, field, value in self.classify_interface_lines(outputs[2].result, RE_SHOW_INTERFACES):
+            setattr(interface, field, value)
+
+    def classify_interface_lines(self, output, pattern):
+        """Yield (interface, field, value) for every line of known interface's section matched by pattern.
+        Section starts with not indented "<interface> is ..., line protocol is ..." line."""
+        interface = None
+        for line in output.splitlines():
+            if line[:1].strip():
+                r = RE_INTERFACE_HEADER.match(line)
+                interface = self.interfaces.get(r.group(1)) if r else None
+                continue
+            if interface is None:
+                continue
+            r = pattern.match(line)
             if r:
-                self.interfaces.setdefault(r.group(1), DeviceInterface(name=r.group(1)))
-
-        ifaces = re.split(r"\n(?=\S)", outputs[1].result)
-        for iface in ifaces:
-            i = ""
-            for line in iface.splitlines():
-                r = re.match(r"^(\S+)\s+is\s+.*protocol\s+is\s.*", line)
-                if r:
-                    if r.group(1) in self.interfaces:
-                        i = r.group(1)
-                        continue
-                    else:
-                        break
-                r = re.match(fr"^\s+.*address\s+is\s+({REGEX_IP}/\d+)", line)
-                if r:
-                    self.interfaces[i].address = r.group(1)
-                    continue
-                r = re.match(r"^\s+.*determined\s+by\s+(DHCP|IPCP){1}", line)
-                if r:
-                    self.interfaces[i].dhcp = True
-                    continue
-                r = re.match(r"^\s+.*MTU\s+is\s+(\d+)\s+bytes", line)
-                if r:
-                    self.interfaces[i].mtu = int(r.group(1))
-                    continue
-                r = re.match(r"^\s+VPN\s+Routing.*\"(\S+)\"", line)
-                if r:
-                    self.interfaces[i].vrf = r.group(1)
-                    continue
-                r = re.match(fr"^\s+Secondary\s+address\s+({REGEX_IP}/\d+)", line)
-                if r:
-                    if not hasattr(self.interfaces[i], "secondary"):
-                        self.interfaces[i].secondary = [r.group(1)]
-                    else:
-                        self.interfaces[i].secondary.append(r.group(1))
-                    continue
-
-        ifaces = re.split(r"\n(?=\S)", outputs[2].result)
-        for iface in ifaces:
-            i = ""
-            for line in iface.splitlines():
-                r = re.match(r"^(\S+)\s+is\s+.*protocol\s+is\s.*", line)
-                if r:
-                    if r.group(1) in self.interfaces:
-                        i = r.group(1)
-                        continue
-                    else:
-                        break
-                r = re.match(r"^\s+Description:\s+(.*)", line)
-                if r:
-                    self.interfaces[i].description = r.group(1)
-                    continue
-                r = re.match(r"^\s+Hardware\s+.*\(bia\s+(\S{14})\)", line)
-                if r:
-                    self.interfaces[i].mac = r.group(1)
-                    continue
-
-    def parse_sim_info(self, connection):
-        """Get SIM info."""
-        outputs = connection.send_commands(
-            [
-                "show controllers cellular 0 | s (^SIM [0|1])",
-            ]
-        )
+                yield interface, r.lastgroup, r.group(r.lastgroup)
 
+    @parse_timer
+    def parse_sim_info(self, outputs):
+        """Get SIM info from outputs of SHOW_SIM_COMMANDS."""
         for line in outputs[0].result.splitlines():
             r = re.match(r"^SIM\s+\d+\s+is\s+present", line)
             if r:
@@ -172,43 +461,39 @@ class CiscoDevice:
                 continue
 
 
+    @parse_timer
+    def parse_show_version(self, response):
+        """Parse "show version" response with parser from PARSERS registry."""
+        for field, value in PARSERS[(self.platform, "show version")](response.result).items():
+            setattr(self, field, value)
+
     def get_device_info(self, connection):
         """Gather and parse information from device."""
-        if self.platform == 'iosxe':
-            parsed = connection.send_command("show version").textfsm_parse_output()[0]
-            self.hostname = parsed['hostname']
-            self.pid = parsed['hardware'][0]
-            self.sn = parsed['serial'][0]
-            self.sw = parsed['version']
-        elif self.platform == 'nxos':
-            parsed = connection.send_command("show version").textfsm_parse_output()[0]
-            self.hostname = parsed['hostname']
-            self.pid = parsed['platform']
-            self.sn = parsed['serial']
-            self.sw = parsed['os']
-        elif self.platform == 'iosxr':
-            result = connection.send_command("show version").result
-            r_search = re.search(r'\n(.*)uptime', result)
-            if r_search:
-                self.hostname = r_search.group(1)
-            r_search = re.search(r'Version\s(.*)\n', result)
-            if r_search:
-                self.sw = r_search.group(1)
-            self.sn = ''
-            r_search = re.search(r'cisco\s(.*)\sprocessor', result)
-            if r_search:
-                self.pid = r_search.group(1)
+        self.parse_show_version(connection.send_command("show version"))
+        if COLLECT_INTERFACES_DATA:
+            self.parse_show_interfaces(connection.send_commands(SHOW_INTERFACES_COMMANDS))
+        if self.pid in NETBOX_DUAL_SIM_PLATFORM:
+            self.parse_sim_info(connection.send_commands(SHOW_SIM_COMMANDS))
+
+    async def get_device_info_async(self, connection):
+        """Gather and parse information from device over an asyncio connection."""
+        self.parse_show_version(await connection.send_command("show version"))
         if COLLECT_INTERFACES_DATA:
-            self.parse_show_interfaces(connection)
+            self.parse_show_interfaces(await connection.send_commands(SHOW_INTERFACES_COMMANDS))
         if self.pid in NETBOX_DUAL_SIM_PLATFORM:
-            self.parse_sim_info(connection)
+            self.parse_sim_info(await connection.send_commands(SHOW_SIM_COMMANDS))
 
 
     def update_custom_field(self, cf_name, cf_value):
-        """Update netbox custom_field value."""
-        device_netbox = self.task.device
-        device_netbox.custom_field_data[cf_name] = cf_value
-        device_netbox.save()
+        """Update netbox custom_field value. Changes are buffered until flush_custom_fields()."""
+        if cf_name:
+            self.custom_fields[cf_name] = cf_value
+
+    def flush_custom_fields(self):
+        """Write all buffered custom_field changes to NetBox at once."""
+        if self.custom_fields:
+            save_custom_fields(self.task.device, self.custom_fields)
+            self.custom_fields = {}
 
 
 class CollectDeviceData(CiscoDevice):
@@ -220,17 +505,57 @@ class CollectDeviceData(CiscoDevice):
         super().__init__(task=collect_task)
         self.collect_status = False
         self.hostname_ipam = hostname_ipam.strip()
+        # Files written to git repository, only they are staged for commit
+        self.written_files = []
         self.device = {
             "host": ip,
             "auth_username": DEVICE_USERNAME,
             "auth_password": DEVICE_PASSWORD,
             "auth_strict_key": False,
             "port": DEVICE_SSH_PORT,
+            "transport": "system",
             "timeout_socket": 20,
             "timeout_ops": 60,
             "ssh_config_file": os.path.dirname(importlib.util.find_spec("config_officer").origin) + "/ssh_config",
         }
-        self.platform = platform if platform in PLATFORMS else "iosxe"
+        # Transport, port and platform that worked last time
+        self.state = DeviceCollectionState.objects.filter(device=collect_task.device).first()
+        if platform in PLATFORMS:
+            self.platform = platform
+        elif self.state and self.state.platform in PLATFORMS:
+            self.platform = self.state.platform
+        else:
+            self.platform = "iosxe"
+
+    def get_transports(self):
+        """Get (transport, port) pairs to try. Transport that worked last time goes first."""
+        transports = [("system", DEVICE_SSH_PORT), ("telnet", 23)]
+        if self.state and self.state.transport:
+            last = (self.state.transport, self.state.port)
+            if last in transports:
+                transports.remove(last)
+            transports.insert(0, last)
+        return transports
+
+    def get_reachability_ports(self):
+        """Get TCP ports of the transports to try, the port that worked last time goes first."""
+        return [port for _, port in self.get_transports()]
+
+    def save_collection_state(self, config_hash):
+        """Remember working transport, port, platform and running config hash for the next collection."""
+        state = {
+            "transport": self.device["transport"],
+            "port": self.device["port"],
+            "platform": self.platform,
+            "config_hash": config_hash,
+            "change_marker": self.change_marker,
+            "last_collected": timezone.now(),
+            "config_path": os.path.relpath(self.get_config_filename(), NETBOX_DEVICES_CONFIGS_DIR),
+        }
+        if self.state:
+            DeviceCollectionState.objects.filter(pk=self.state.pk).update(**state)
+        else:
+            self.state = DeviceCollectionState.objects.create(device=self.task.device, **state)
 
     # Check if NetBox and Device data are the same
     def check_netbox_sync(self):
@@ -250,138 +575,325 @@ class CollectDeviceData(CiscoDevice):
     def update_in_netbox(self):
         """Update information in NetBox."""
         # Custom fields
-        self.update_custom_field(CF_NAME_SSH, self.device["port"] == 22)
+        self.update_custom_field(CF_NAME_SSH, self.device["transport"] != "telnet")
         self.update_custom_field(CF_NAME_SW_VERSION, self.sw.upper())
         self.update_custom_field(CF_NAME_LAST_COLLECT_DATE, datetime.now(pytz.timezone(TIME_ZONE)).date())
         self.update_custom_field(CF_NAME_LAST_COLLECT_TIME, datetime.now(pytz.timezone(TIME_ZONE)).strftime("%H:%M:%S"))
 
         # Update information about interfaces
         if COLLECT_INTERFACES_DATA:
-            ipam_interfaces_list = [
-                str(x) for x in list(Interface.objects.filter(device=self.task.device))
-            ]
+            self.update_interfaces_in_netbox()
 
-            template_interfaces = list(map(lambda d: d['name'], DeviceType.objects.get(slug__iexact=self.pid).interfacetemplates.values('name')))
+    def update_interfaces_in_netbox(self):
+        """Reconcile interfaces and IP addresses in NetBox with the device.
+        Current state is loaded with a few queries, delta is applied in bulk within one transaction."""
+        device = self.task.device
+        interface_ct = ContentType.objects.get_for_model(Interface)
+        INTERFACE_TEMPLATES_CACHE.check_version()
+        VRF_CACHE.check_version()
+        template_interfaces = self.get_template_interfaces()
 
-            # Delete extra interfaces that non-compliant with DeviceType and don't contain in device from netbox
-            for inter in Interface.objects.filter(device=self.task.device):
-                if (inter.name not in list(self.interfaces.keys())) and (inter.name not in template_interfaces):
-                    inter.delete()
-
-            # Write down interfaces into NetBox
-            for k, v in self.interfaces.items():
-                if k not in ipam_interfaces_list:
-                    if re.match(r"^FastEthernet", k, re.IGNORECASE):
-                        new_if_type = InterfaceTypeChoices.TYPE_100ME_FIXED
-                    elif re.match(r"^GigabitEthernet", k, re.IGNORECASE):
-                        new_if_type = InterfaceTypeChoices.TYPE_1GE_FIXED
-                    elif re.match(r"^Vlan", k, re.IGNORECASE):
-                        new_if_type = InterfaceTypeChoices.TYPE_VIRTUAL
-                    elif re.match(r"^Loopback", k, re.IGNORECASE):
-                        new_if_type = InterfaceTypeChoices.TYPE_VIRTUAL
-                    else:
-                        new_if_type = InterfaceTypeChoices.TYPE_OTHER
+        with transaction.atomic():
+            ipam_interfaces = {i.name: i for i in Interface.objects.filter(device=device)}
 
-                    interface_ipam = Interface.objects.create(
-                        device=self.task.device, name=k, type=new_if_type
-                    )
-                else:
-                    interface_ipam = Interface.objects.get(
-                        device=self.task.device, name__iexact=k
-                    )
-
-                # # Delete extra ips from IPAM
-                if hasattr(v, "address"):
-                    interface_addresses = [v.address]
-                else:
-                    interface_addresses = list()
-                if hasattr(v, "secondary"):
-                    interface_addresses.append(v.secondary)
+            # Delete extra interfaces that non-compliant with DeviceType and don't contain in device from netbox
+            extra_interfaces = [
+                name for name in ipam_interfaces if name not in self.interfaces and name not in template_interfaces
+            ]
+            if extra_interfaces:
+                Interface.objects.filter(pk__in=[ipam_interfaces.pop(name).pk for name in extra_interfaces]).delete()
 
-                for ip_ipam in IPAddress.objects.filter(interface=interface_ipam):
-                    if str(ip_ipam) not in interface_addresses:
-                        ip_ipam.delete()
+            # Write down new interfaces into NetBox
+            new_interfaces = [
+                Interface(device=device, name=name, type=get_interface_type(name))
+                for name in self.interfaces if name not in ipam_interfaces
+            ]
+            for interface_ipam in Interface.objects.bulk_create(new_interfaces):
+                ipam_interfaces[interface_ipam.name] = interface_ipam
+
+            # Change interface data
+            changed_interfaces = []
+            for name, v in self.interfaces.items():
+                interface_ipam = ipam_interfaces[name]
+                changed = False
+                if hasattr(v, "description") and interface_ipam.description != v.description:
+                    interface_ipam.description = v.description
+                    changed = True
+                if hasattr(v, "mac"):
+                    mac = EUI(v.mac, version=48, dialect=mac_unix_expanded_uppercase)
+                    if interface_ipam.mac_address != mac:
+                        interface_ipam.mac_address = mac
+                        changed = True
+                if changed:
+                    changed_interfaces.append(interface_ipam)
+            if changed_interfaces:
+                Interface.objects.bulk_update(changed_interfaces, ["description", "mac_address"])
+
+            # Current addresses of device interfaces: {interface_id: {address: IPAddress}}
+            ipam_addresses = {}
+            for ip in IPAddress.objects.filter(
+                assigned_object_type=interface_ct,
+                assigned_object_id__in=[i.pk for i in ipam_interfaces.values()],
+            ):
+                ipam_addresses.setdefault(ip.assigned_object_id, {})[str(ip.address)] = ip
+
+            vrfs = self.get_vrfs({v.vrf for v in self.interfaces.values() if hasattr(v, "vrf")})
+
+            delete_ips = []
+            create_ips = []
+            update_ips = []
+            for name, v in self.interfaces.items():
+                interface_ipam = ipam_interfaces[name]
+                current = ipam_addresses.get(interface_ipam.pk, {})
+                vrf = vrfs[v.vrf.lower()] if hasattr(v, "vrf") else None
+
+                # Delete extra ips from IPAM
+                interface_addresses = [v.address] if hasattr(v, "address") else []
+                interface_addresses.extend(getattr(v, "secondary", []))
+                delete_ips.extend(ip.pk for address, ip in current.items() if address not in interface_addresses)
 
                 # Create address if not exist in IPAM
                 if hasattr(v, "address"):
-                    ips_ipam_str_list = [str(x.address) for x in IPAddress.objects.filter(interface=interface_ipam)]
-                    if v.address not in ips_ipam_str_list:
-                        ip = IPAddress.objects.create(address=v.address, tenant=self.task.device.tenant)
-                        interface_ipam.ip_addresses.add(ip)
-
-                        if re.match(r"^Loopback", k, re.IGNORECASE):
+                    ip = current.get(v.address)
+                    if ip is None:
+                        ip = IPAddress(
+                            address=v.address,
+                            tenant=device.tenant,
+                            assigned_object_type=interface_ct,
+                            assigned_object_id=interface_ipam.pk,
+                        )
+                        if re.match(r"^Loopback", name, re.IGNORECASE):
                             ip.role = IPAddressRoleChoices.ROLE_LOOPBACK
+                        if vrf:
+                            ip.vrf = vrf
+                        if v.dhcp:
+                            ip.status = IPAddressStatusChoices.STATUS_DHCP
+                        create_ips.append(ip)
+                    elif (vrf and ip.vrf_id != vrf.pk) or (
+                        v.dhcp and ip.status != IPAddressStatusChoices.STATUS_DHCP
+                    ):
+                        # Only changed addresses are updated
+                        if vrf:
+                            ip.vrf = vrf
+                        if v.dhcp:
+                            ip.status = IPAddressStatusChoices.STATUS_DHCP
+                        update_ips.append(ip)
+
+                for address in getattr(v, "secondary", []):
+                    ip = current.get(address)
+                    if ip is not None:
+                        # Secondary address follows VRF of the interface
+                        if ip.vrf_id != (vrf.pk if vrf else None):
+                            ip.vrf = vrf
+                            update_ips.append(ip)
                     else:
-                        ip = IPAddress.objects.get(address=v.address, interface=interface_ipam)
-
-                    if hasattr(v, "vrf"):
-                        try:
-                            ip.vrf = VRF.objects.get(name__iexact=v.vrf)
-                        except VRF.DoesNotExist:
-                            new_vrf = VRF.objects.create(name=v.vrf, enforce_unique=False)
-                            # new_vrf.tags.add(NETBOX_NONCOMPLIANCE_TAG)
-                            new_vrf.save()
-                            ip.vrf = new_vrf
-
-                    if v.dhcp:
-                        ip.status = IPAddressStatusChoices.STATUS_DHCP
-                    ip.save()
-                if hasattr(v, "secondary"):
-                    for i in v.secondary:
-                        ip = IPAddress.objects.create(address=i, role=IPAddressRoleChoices.ROLE_SECONDARY)
-                        interface_ipam.ip_addresses.add(ip)
-                        # ip.interface = Interface.objects.get(device=self.ot.device, name__iexact=k)
-                        if hasattr(v, "vrf"):
-                            ip.vrf = VRF.objects.get(name__iexact=v.vrf)
-                        # ip.tags.add(NETBOX_NONCOMPLIANCE_TAG)
-                        ip.save()
-
-                # Change interface data
-                if hasattr(v, "description"):
-                    interface_ipam.description = v.description
-
-                if hasattr(v, "mac"):
-                    interface_ipam.mac_address = EUI(
-                        v.mac, version=48, dialect=mac_unix_expanded_uppercase
-                    )
-
-                # if k == self.mgmt_if:
-                #     self.task.device.primary_ip4 = ip
-                #     self.task.device.save()
-
-                interface_ipam.save()
-
-    def save_running_config_to_file(self, connection, filename):
-        """Save show run config to git repository."""
+                        create_ips.append(
+                            IPAddress(
+                                address=address,
+                                role=IPAddressRoleChoices.ROLE_SECONDARY,
+                                vrf=vrf,
+                                assigned_object_type=interface_ct,
+                                assigned_object_id=interface_ipam.pk,
+                            )
+                        )
+
+            if delete_ips:
+                IPAddress.objects.filter(pk__in=delete_ips).delete()
+            if create_ips:
+                IPAddress.objects.bulk_create(create_ips)
+            if update_ips:
+                IPAddress.objects.bulk_update(update_ips, ["vrf", "status"])
+
+    def get_template_interfaces(self):
+        """Get interface names of device type (cached)."""
+        template_interfaces = INTERFACE_TEMPLATES_CACHE.get(self.pid.lower())
+        if template_interfaces is None:
+            template_interfaces = frozenset(
+                DeviceType.objects.get(slug__iexact=self.pid).interfacetemplates.values_list("name", flat=True)
+            )
+            INTERFACE_TEMPLATES_CACHE.set(self.pid.lower(), template_interfaces)
+        return template_interfaces
+
+    def get_vrfs(self, names):
+        """Get VRFs by names (case insensitive). Not cached VRFs are fetched with one query, missing ones are created."""
+        vrfs = {}
+        for name in names:
+            vrf = VRF_CACHE.get(name.lower())
+            if vrf is not None:
+                vrfs[name.lower()] = vrf
+        missing = [name for name in names if name.lower() not in vrfs]
+        if missing:
+            query = Q()
+            for name in missing:
+                query |= Q(name__iexact=name)
+            for vrf in VRF.objects.filter(query):
+                if vrf.name.lower() not in vrfs:
+                    vrfs[vrf.name.lower()] = vrf
+                    VRF_CACHE.set(vrf.name.lower(), vrf)
+        for name in missing:
+            if name.lower() not in vrfs:
+                vrfs[name.lower()] = VRF.objects.create(name=name, enforce_unique=False)
+        return vrfs
+
+    def get_running_config(self, connection):
+        """Get show run config."""
         connection.send_command("terminal length 0")
-        with open(filename, "w") as f:
-            output = connection.send_command("show running-config")
-            f.write(output.result)
+        output = connection.send_command("show running-config")
+        return output.result
+
+    def get_config_filename(self):
+        """Get running config file name in git repository."""
+        site = self.task.device.site.slug if self.task.device else None
+        return os.path.join(NETBOX_DEVICES_CONFIGS_DIR, get_config_path(self.hostname.strip(), "running", site=site))
+
+    @parse_timer
+    def parse_change_marker(self, response):
+        """Get change marker (i.e. "Last configuration change" header) from command response."""
+        r = re.search(CHANGE_MARKER_COMMANDS[self.platform][1], response.result, re.MULTILINE)
+        if r:
+            self.change_marker = r.group(0).strip()
+
+    def is_config_unchanged(self):
+        """Check if change marker is the same as during the last collection."""
+        return bool(
+            self.change_marker
+            and self.state
+            and self.state.change_marker == self.change_marker
+            and self.state.config_hash
+            and os.path.exists(self.get_config_filename())
+        )
 
-    def collect_information(self):
-        """Sync current device."""
-        self.check_reachability()
+    def get_change_marker(self, connection):
+        """Get change marker from device if incremental collection is enabled."""
+        if INCREMENTAL_COLLECTION and self.platform in CHANGE_MARKER_COMMANDS:
+            self.parse_change_marker(connection.send_command(CHANGE_MARKER_COMMANDS[self.platform][0]))
 
+    def fetch_information(self):
+        """Get device info and running config within one session.
+        Running config is None if incremental collection found no changes."""
+        self.task.login_count += 1
+        started = time.monotonic()
+        with PLATFORMS[self.platform](**self.device) as connection:
+            self.login_time = time.monotonic() - started
+            self.get_device_info(connection)
+            self.get_change_marker(connection)
+            if self.is_config_unchanged():
+                return None
+            return self.get_running_config(connection)
+
+    def get_async_connection_params(self):
+        """Connection parameters for ASYNC_PLATFORMS drivers."""
+        params = dict(self.device)
+        params["transport"] = ASYNC_TRANSPORTS[self.device.get("transport", "system")]
+        if params["transport"] == "asyncssh":
+            params["transport_options"] = {"asyncssh": ASYNCSSH_OPTIONS}
+        return params
+
+    async def get_running_config_async(self, connection):
+        """Get show run config over an asyncio connection."""
+        await connection.send_command("terminal length 0")
+        output = await connection.send_command("show running-config")
+        return output.result
+
+    async def get_change_marker_async(self, connection):
+        """Get change marker over an asyncio connection."""
+        if INCREMENTAL_COLLECTION and self.platform in CHANGE_MARKER_COMMANDS:
+            self.parse_change_marker(await connection.send_command(CHANGE_MARKER_COMMANDS[self.platform][0]))
+
+    async def fetch_information_async(self):
+        """Get device info and running config within one asyncio session."""
+        self.task.login_count += 1
+        started = time.monotonic()
+        async with ASYNC_PLATFORMS[self.platform](**self.get_async_connection_params()) as connection:
+            self.login_time = time.monotonic() - started
+            await self.get_device_info_async(connection)
+            await self.get_change_marker_async(connection)
+            if self.is_config_unchanged():
+                return None
+            return await self.get_running_config_async(connection)
+
+    def move_config_file(self, filename):
+        """Move config file saved last time to the current path, i.e. device moved to another site.
+        Old file is not left behind, both paths are staged, so git records it as a rename."""
+        if not (self.state and self.state.config_path):
+            return
+        old_filename = os.path.join(NETBOX_DEVICES_CONFIGS_DIR, self.state.config_path)
+        if old_filename == filename or not os.path.exists(old_filename):
+            return
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        os.replace(old_filename, filename)
+        self.written_files.extend([old_filename, filename])
         try:
-            with PLATFORMS[self.platform](**self.device) as connection:
-                self.get_device_info(connection)
-        except Exception:
-            self.device["port"] = 23
-            self.device["transport"] = "telnet"
-            try:
-                with PLATFORMS[self.platform](**self.device) as connection:
-                    self.get_device_info(connection)
-            except Exception:
-                raise CollectionException(
-                    reason=CollectFailChoices.FAIL_LOGIN,
-                    message="Can not login",
-                )
+            os.removedirs(os.path.dirname(old_filename))
+        except OSError:
+            # Directory is not empty
+            pass
+
+    def save_information(self, running_config):
+        """Check collected data, update NetBox and save running config to git repository."""
+        # Running config used to be collected over one more login.
+        self.task.login_time_saved = round(self.login_time, 2)
 
         self.check_netbox_sync()
         self.update_in_netbox()
 
-        # save to git repo
+        # save to git repo. Unchanged config is not rewritten, so git and compliance check could skip it.
         self.hostname = self.hostname.strip()
-        filename = f"{NETBOX_DEVICES_CONFIGS_DIR}/{self.hostname}_running.txt"
-        with PLATFORMS[self.platform](**self.device) as connection:
-            self.save_running_config_to_file(connection, filename)
+        filename = self.get_config_filename()
+        self.move_config_file(filename)
+        if running_config is None:
+            # Change marker is the same, running config was not pulled
+            config_hash = self.state.config_hash
+            self.task.config_changed = False
+        else:
+            # Volatile header lines (timestamps) are not hashed, otherwise the config is always "changed"
+            config_hash = hashlib.sha256(normalize_config(running_config).encode()).hexdigest()
+            self.task.config_changed = not (
+                self.state and self.state.config_hash == config_hash and os.path.exists(filename)
+            )
+        if self.task.config_changed:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, "w") as f:
+                f.write(running_config)
+            self.written_files.append(filename)
+        self.save_collection_state(config_hash)
+
+    async def collect_information_async(self, check_reachability=True):
+        """Sync current device. Network I/O is done with asyncio, NetBox is updated in a sync thread."""
+        if check_reachability:
+            await self.check_reachability_async()
+
+        for transport, port in self.get_transports():
+            self.device.update(transport=transport, port=port)
+            try:
+                running_config = await self.fetch_information_async()
+                break
+            except Exception:
+                continue
+        else:
+            raise CollectionException(
+                reason=CollectFailChoices.FAIL_LOGIN,
+                message="Can not login",
+            )
+
+        await sync_to_async(self.save_information)(running_config)
+
+    def collect_information(self, check_reachability=True):
+        """Sync current device. Reachability check could be skipped if it was done in advance."""
+        if check_reachability:
+            self.check_reachability()
+
+        for transport, port in self.get_transports():
+            self.device.update(transport=transport, port=port)
+            try:
+                running_config = self.fetch_information()
+                break
+            except Exception:
+                continue
+        else:
+            raise CollectionException(
+                reason=CollectFailChoices.FAIL_LOGIN,
+                message="Can not login",
+            )
+
+        self.save_information(running_config)
@@ -3,6 +3,26 @@
 import diffios
 import re
 
+# Lines which change without any configuration change: headers with timestamps and config sizes.
+# They are ignored by template compliance check and by running config change detection.
+VOLATILE_CONFIG_LINES = [
+    "Building configuration",
+    "Current configuration",
+    "NVRAM config last updated",
+    "Last configuration change",
+    # NX-OS
+    "!Time:",
+    "!Running configuration last done at",
+    # IOS-XR prints command timestamp, i.e. "Thu Mar  4 10:11:12.345 UTC"
+    r"^(Mon|Tue|Wed|Thu|Fri|Sat|Sun) (Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) +\d+ \d+:\d+:\d+",
+]
+RE_VOLATILE_CONFIG_LINE = re.compile("|".join(f"(?:{line})" for line in VOLATILE_CONFIG_LINES))
+
+
+def normalize_config(config):
+    """Get config without volatile lines, so equal configurations are equal strings."""
+    return "\n".join(line for line in config.splitlines() if not RE_VOLATILE_CONFIG_LINE.search(line))
+
 
 def get_lines_in_section(config, section):
     """Get lines (i.e ip address x.x.x.x) under the section's name (i.e. interface GigabitEthernet0)."""
@@ -66,12 +86,7 @@ def get_config_diff(template, config, ignore=None):
     """Get inconsistency between device running config and template."""
     
     if not ignore:
-        ignore = [
-            "Building configuration",
-            "Current configuration",
-            "NVRAM config last updated",
-            "Last configuration change",
-        ]
+        ignore = VOLATILE_CONFIG_LINES
 
     diff = diffios.Compare(template, config, ignore)
 
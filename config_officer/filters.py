@@ -1,8 +1,11 @@
 from utilities.filters import TreeNodeMultipleChoiceFilter
 import django_filters
-from .models import Collection
+from .models import Collection, ConfigChange
 from django.db.models import Q
-from dcim.models import DeviceRole, DeviceType
+from dcim.models import DeviceRole, DeviceType, Site
+from tenancy.models import Tenant
+from django.utils import timezone
+from datetime import timedelta
 from .choices import ServiceComplianceChoices
 from netbox.filtersets import PrimaryModelFilterSet
 from extras.filters import TagFilter
@@ -17,7 +20,7 @@ class CollectionFilter(PrimaryModelFilterSet):
 
     class Meta:
         model = Collection
-        fields = ['status', 'failed_reason']
+        fields = ['status', 'failed_reason', 'run']
 
     def search(self, queryset, name, value):
         if not value.strip():
@@ -78,3 +81,68 @@ class ServiceMappingFilter(PrimaryModelFilterSet, TenancyFilterSet):
             | Q(asset_tag__icontains=value.strip())
             | Q(compliance__services__contains=value.strip().splitlines())
         ).distinct()
+
+
+class ConfigChangeFilter(PrimaryModelFilterSet):
+    """Filter for fleet-wide device config changes feed."""
+    q = django_filters.CharFilter(
+        method='search',
+        label='Search device or commit message',
+    )
+    site_id = django_filters.ModelMultipleChoiceFilter(
+        field_name='device__site',
+        queryset=Site.objects.all(),
+        label='Site (ID)',
+    )
+    site = django_filters.ModelMultipleChoiceFilter(
+        field_name='device__site__slug',
+        queryset=Site.objects.all(),
+        to_field_name='slug',
+        label='Site (slug)',
+    )
+    role_id = django_filters.ModelMultipleChoiceFilter(
+        field_name='device__device_role',
+        queryset=DeviceRole.objects.all(),
+        label='Role (ID)',
+    )
+    role = django_filters.ModelMultipleChoiceFilter(
+        field_name='device__device_role__slug',
+        queryset=DeviceRole.objects.all(),
+        to_field_name='slug',
+        label='Role (slug)',
+    )
+    tenant_id = django_filters.ModelMultipleChoiceFilter(
+        field_name='device__tenant',
+        queryset=Tenant.objects.all(),
+        label='Tenant (ID)',
+    )
+    tenant = django_filters.ModelMultipleChoiceFilter(
+        field_name='device__tenant__slug',
+        queryset=Tenant.objects.all(),
+        to_field_name='slug',
+        label='Tenant (slug)',
+    )
+    since = django_filters.IsoDateTimeFilter(
+        field_name='date',
+        lookup_expr='gte',
+    )
+    last_hours = django_filters.NumberFilter(
+        method='filter_last_hours',
+        label='Changed in the last hours',
+    )
+
+    class Meta:
+        model = ConfigChange
+        fields = ['id', 'hostname', 'commit', 'run', 'device_id']
+
+    def search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return queryset.filter(
+            Q(hostname__icontains=value.strip())
+            | Q(message__icontains=value.strip())
+            | Q(commit__startswith=value.strip())
+        )
+
+    def filter_last_hours(self, queryset, name, value):
+        return queryset.filter(date__gte=timezone.now() - timedelta(hours=float(value)))
@@ -12,9 +12,10 @@ from .models import (
     Collection, 
     Template,
     Service,
-    ServiceMapping
+    ServiceMapping,
+    ConfigChange
 )
-from dcim.models import DeviceRole, DeviceType, Device
+from dcim.models import DeviceRole, DeviceType, Device, Site
 from tenancy.models import Tenant
 from .choices import ServiceComplianceChoices
 
@@ -191,4 +192,37 @@ class ServiceMappingFilterForm(BootstrapMixin, forms.ModelForm):
 
     class Meta:
         model = Device
-        fields = ['q', 'status', 'role', 'tenant', 'device_type_id', 'tag']
\ No newline at end of file
+        fields = ['q', 'status', 'role', 'tenant', 'device_type_id', 'tag']
+
+class ConfigChangeFilterForm(BootstrapMixin, forms.ModelForm):
+    """Form for filtering fleet-wide device config changes."""
+
+    field_order = ['q', 'last_hours', 'site', 'role', 'tenant']
+    q = forms.CharField(
+        required=False,
+        label='Search device or commit message'
+    )
+    last_hours = forms.IntegerField(
+        required=False,
+        min_value=1,
+        label='Changed in the last hours'
+    )
+    site = DynamicModelMultipleChoiceField(
+        queryset=Site.objects.all(),
+        to_field_name='slug',
+        required=False,
+    )
+    role = DynamicModelMultipleChoiceField(
+        queryset=DeviceRole.objects.all(),
+        to_field_name='slug',
+        required=False,
+    )
+    tenant = DynamicModelMultipleChoiceField(
+        queryset=Tenant.objects.all(),
+        to_field_name='slug',
+        required=False,
+    )
+
+    class Meta:
+        model = ConfigChange
+        fields = ['q', 'last_hours', 'site', 'role', 'tenant']
@@ -1,64 +1,126 @@
 """Manage data in local git repository."""
 
-from pydriller import RepositoryMining, GitRepository
+from git import Repo
 import time
 import os
-from datetime import datetime
+import hashlib
+from datetime import datetime, timezone
+from django.conf import settings
 
-def get_device_config(directory, hostname, config_type="running"):
+PLUGIN_SETTINGS = settings.PLUGINS_CONFIG.get("config_officer", dict())
+# "flat" - {hostname}_{config_type}.txt in repository root,
+# "site" - in {site slug}/ directory, "hash" - in {first chars of hostname sha1}/ directory
+CONFIGS_LAYOUT = PLUGIN_SETTINGS.get("CONFIGS_LAYOUT", "flat")
+CONFIGS_LAYOUTS = ("flat", "site", "hash")
+CONFIGS_HASH_PREFIX_LENGTH = PLUGIN_SETTINGS.get("CONFIGS_HASH_PREFIX_LENGTH", 2)
+NO_SITE_DIR = "_no_site"
+# Commit of layout migration only moves files, it is not indexed as config changes
+RESHARD_COMMIT_MESSAGE = "reshard device configs"
+
+
+def get_config_path(hostname, config_type="running", site=None, layout=None):
+    """Get device config file path relative to repository, according to the layout (CONFIGS_LAYOUT by default).
+    Site slug is looked up by hostname if it is not passed for "site" layout."""
+
+    layout = layout or CONFIGS_LAYOUT
+    filename = f"{hostname}_{config_type}.txt"
+    if layout == "flat":
+        return filename
+
+    # Sharded layouts keep exactly one directory level
+    filename = filename.replace("/", "_").replace("\\", "_")
+    if layout == "hash":
+        return os.path.join(hashlib.sha1(hostname.encode()).hexdigest()[:CONFIGS_HASH_PREFIX_LENGTH], filename)
+    if site is None:
+        from dcim.models import Device
+
+        site = Device.objects.filter(name__iexact=hostname).values_list("site__slug", flat=True).first()
+    return os.path.join(site or NO_SITE_DIR, filename)
+
+
+def get_device_config(directory, hostname, config_type="running", site=None):
     """Get data from text file according to config source."""
     try:
-        with open(f"{directory}/{hostname}_{config_type}.txt", "r") as file:
+        with open(os.path.join(directory, get_config_path(hostname, config_type, site)), "r") as file:
             return file.read()
     except FileNotFoundError:
         return None
 
 
-def get_days_after_update(directory, hostname, config_type="running"):
+def get_days_after_update(directory, hostname, config_type="running", site=None):
     """Get days after last update."""
     try:
-        create_time = os.stat(f"{directory}/{hostname}_{config_type}.txt").st_ctime        
+        create_time = os.stat(os.path.join(directory, get_config_path(hostname, config_type, site))).st_ctime        
         return round((time.time() - create_time) / 86400)
     except:
         return -1
 
 
-def get_config_update_date(directory, hostname, config_type="running"):
+def get_config_update_date(directory, hostname, config_type="running", site=None):
     """Get date of last update device config file."""
 
     try:
-        create_time = os.stat(f"{directory}/{hostname}_{config_type}.txt").st_ctime   
+        create_time = os.stat(os.path.join(directory, get_config_path(hostname, config_type, site))).st_ctime   
         return datetime.fromtimestamp(create_time).strftime("%Y-%m-%d %H:%M")       
     except:
         return "unknown"
 
 
-def get_file_repo_state(repository_path, filename):
-    """Get commits and diffs for file."""
-
-    git_repo = GitRepository(repository_path)
-    repo_state = {}
-    repo_state["commits_count"] = 0
-    # try:
-    file_commits_list = git_repo.git.log("--format=%H", filename).split("\n")
-    file_commits = list(RepositoryMining(repository_path, only_commits=file_commits_list).traverse_commits())
-    file_commits.reverse()
-    repo_state["commits_count"] = len(file_commits)
-    # except Exception as e:
-    #     pass
-        
-    if repo_state["commits_count"] > 0:
-        repo_state["last_commit_date"] = file_commits[0].author_date.strftime("%d %b %Y %H:%M")
-        repo_state["first_commit_date"] = file_commits[-1].author_date.strftime("%d %b %Y %H:%M")
-        repo_state["commits"] = []
-        for commit in file_commits:
-            print(commit.hash)
-            for mod in commit.modifications:
-                if mod.filename == filename:
-                    diff = mod.diff
-            repo_state["commits"].append(
-                {"hash": commit.hash, "msg": commit.msg, "diff": diff, "date": commit.author_date}
-            )
-    else:
-        repo_state["comment"] = f"no commits changes for {filename}"
-    return repo_state
+def parse_config_filename(filename):
+    """Split "{hostname}_{config_type}.txt" file name. None if it is not a device config file."""
+
+    name, ext = os.path.splitext(os.path.basename(filename))
+    hostname, _, config_type = name.rpartition("_")
+    if ext != ".txt" or not hostname:
+        return None
+    return hostname, config_type
+
+
+def get_commits_numstat(repository_path, since=None):
+    """Get commits made after `since` commit (all commits if None), oldest first,
+    with added/deleted lines count per file. All commits are read by one git log pass.
+    Renamed file (i.e. device moved to another site directory) is one entry of the new path with changed lines only."""
+
+    repo = Repo(repository_path)
+    if not repo.head.is_valid():
+        return []
+    revision = f"{since}..HEAD" if since else "HEAD"
+    output = repo.git.log("--reverse", "--numstat", "-M", "-z", "--format=%x1e%H%x1f%at%x1f%s", revision)
+
+    commits = []
+    for record in output.split("\x1e")[1:]:
+        header, _, numstat = record.partition("\0")
+        commit_hash, timestamp, msg = header.split("\x1f", 2)
+        files = []
+        # "added\tdeleted\tpath\0" entries, renames are "added\tdeleted\t\0old path\0new path\0"
+        tokens = iter(numstat.lstrip("\n").split("\0"))
+        for token in tokens:
+            if not token.strip():
+                continue
+            added, deleted, filename = token.split("\t", 2)
+            if not filename:
+                next(tokens)
+                filename = next(tokens)
+            # binary files have "-" instead of lines count
+            files.append((filename, int(added) if added != "-" else 0, int(deleted) if deleted != "-" else 0))
+        commits.append(
+            {
+                "hash": commit_hash,
+                "date": datetime.fromtimestamp(int(timestamp), tz=timezone.utc),
+                "msg": msg,
+                "files": files,
+            }
+        )
+    return commits
+
+
+def get_file_diff(repository_path, commit_hash, filename):
+    """Get diff of file made by commit. Commit must have changed the file."""
+
+    try:
+        # Renamed file is diffed against its old path
+        return Repo(repository_path).git.log(
+            "-1", "-p", "-M", "--follow", "--format=", "--no-color", commit_hash, "--", filename
+        )
+    except Exception:
+        return None
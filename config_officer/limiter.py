@@ -0,0 +1,109 @@
+"""Limit of concurrent collection sessions per site, region or custom field value, shared by all workers."""
+
+import uuid
+from django.conf import settings
+
+PLUGIN_SETTINGS = settings.PLUGINS_CONFIG.get("config_officer", dict())
+# Group devices by "site", "region" or "cf_<custom field name>". None disables the limit.
+COLLECTION_LIMIT_BY = PLUGIN_SETTINGS.get("COLLECTION_LIMIT_BY", None)
+# Max concurrent sessions per group, COLLECTION_LIMIT_OVERRIDES sets it for particular slugs or custom field values
+COLLECTION_LIMIT = PLUGIN_SETTINGS.get("COLLECTION_LIMIT", 10)
+COLLECTION_LIMIT_OVERRIDES = PLUGIN_SETTINGS.get("COLLECTION_LIMIT_OVERRIDES", dict())
+# Max time collection waits for a free slot of the group. Waiting collection is deferred, it does not hold a worker
+COLLECTION_LIMIT_WAIT = PLUGIN_SETTINGS.get("COLLECTION_LIMIT_WAIT", 3600)
+
+
+class NoFreeSlot(Exception):
+    """All collection slots of the device group are taken."""
+
+
+def get_limit_group(device):
+    """Name of the device group sharing the concurrency limit. None - device is not limited."""
+
+    if COLLECTION_LIMIT_BY == "site":
+        return device.site.slug
+    if COLLECTION_LIMIT_BY == "region":
+        return device.site.region.slug if device.site.region else None
+    if COLLECTION_LIMIT_BY and COLLECTION_LIMIT_BY.startswith("cf_"):
+        value = device.custom_field_data.get(COLLECTION_LIMIT_BY[3:])
+        return str(value) if value not in (None, "") else None
+    return None
+
+
+def get_group_limit(group):
+    return COLLECTION_LIMIT_OVERRIDES.get(group, COLLECTION_LIMIT)
+
+
+def interleave_by_limit_group(items, get_device):
+    """Reorder items round-robin by device group, so neighbours in a queue or chunk rarely share a limit."""
+
+    if not COLLECTION_LIMIT_BY:
+        return list(items)
+    groups = {}
+    for item in items:
+        groups.setdefault(get_limit_group(get_device(item)), []).append(item)
+    interleaved = []
+    for i in range(max((len(group) for group in groups.values()), default=0)):
+        interleaved.extend(group[i] for group in groups.values() if i < len(group))
+    return interleaved
+
+
+# Drop holders expired by redis server time and take a slot if there is a free one, in one atomic step
+ACQUIRE_SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local now = redis.call("TIME")
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now - tonumber(ARGV[2]))
+if redis.call("ZCARD", KEYS[1]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call("ZADD", KEYS[1], now, ARGV[3])
+redis.call("EXPIRE", KEYS[1], ARGV[2])
+return 1
+"""
+
+
+class RedisSemaphore:
+    """Counting semaphore in a redis sorted set of holder tokens scored by acquire time.
+
+    Slots of crashed holders expire after `timeout` seconds. Expiry is checked against redis server time,
+    so worker clocks don't matter.
+    """
+
+    def __init__(self, connection, name, limit, timeout):
+        self.connection = connection
+        self.name = name
+        self.limit = limit
+        self.timeout = timeout
+        self.token = None
+        self.acquire_script = connection.register_script(ACQUIRE_SCRIPT)
+
+    def acquire(self):
+        """Take a slot if there is a free one. Does not wait."""
+
+        token = uuid.uuid4().hex
+        if self.acquire_script(keys=[self.name], args=[self.limit, self.timeout, token]):
+            self.token = token
+            return True
+        return False
+
+    def release(self):
+        if self.token:
+            self.connection.zrem(self.name, self.token)
+            self.token = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def get_device_semaphore(connection, device, timeout):
+    """Semaphore of the device group. None if the device is not limited."""
+
+    group = get_limit_group(device)
+    if group is None:
+        return None
+    limit = get_group_limit(group)
+    return RedisSemaphore(connection, f"config_officer_collect_limit_{COLLECTION_LIMIT_BY}_{group}", limit, timeout)
@@ -0,0 +1,92 @@
+"""Lookup caches shared by device collections handled by the same worker process."""
+
+from collections import OrderedDict
+from uuid import uuid4
+import threading
+from django.conf import settings
+from django.core.cache import cache
+
+PLUGIN_SETTINGS = settings.PLUGINS_CONFIG.get("config_officer", dict())
+LOOKUP_CACHE_SIZE = PLUGIN_SETTINGS.get("LOOKUP_CACHE_SIZE", 1024)
+# Total size of cached diffs per NetBox process and size of the largest diff cached
+DIFF_CACHE_MAX_BYTES = PLUGIN_SETTINGS.get("DIFF_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+DIFF_CACHE_MAX_ITEM_BYTES = PLUGIN_SETTINGS.get("DIFF_CACHE_MAX_ITEM_BYTES", 1024 * 1024)
+LOOKUP_CACHE_VERSION_KEY = "config_officer_lookup_cache_version"
+
+
+class LookupCache:
+    """Bounded LRU cache. It is cleared when lookup_cache_version is changed by any NetBox process."""
+
+    def __init__(self, maxsize=LOOKUP_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.version = None
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                return default
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def check_version(self):
+        """Drop cached objects if DeviceType or VRF were changed since the last check."""
+        version = cache.get(LOOKUP_CACHE_VERSION_KEY)
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+
+class SizedLookupCache(LookupCache):
+    """LRU cache of strings bounded by their total length instead of entries count.
+    Values longer than maxitem are not cached."""
+
+    def __init__(self, maxbytes, maxitem):
+        super().__init__()
+        self.maxbytes = maxbytes
+        self.maxitem = maxitem
+        self.size = 0
+
+    def set(self, key, value):
+        if len(value) > self.maxitem:
+            return
+        with self.lock:
+            if key in self.data:
+                self.size -= len(self.data[key])
+            self.data[key] = value
+            self.data.move_to_end(key)
+            self.size += len(value)
+            while self.size > self.maxbytes:
+                self.size -= len(self.data.popitem(last=False)[1])
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.size = 0
+
+
+# DeviceType slug -> interface template names
+INTERFACE_TEMPLATES_CACHE = LookupCache()
+# VRF name (lowercase) -> VRF
+VRF_CACHE = LookupCache()
+# (commit hash, file name) -> diff. Diff made by a commit never changes, so the cache is never invalidated
+DIFF_CACHE = SizedLookupCache(DIFF_CACHE_MAX_BYTES, DIFF_CACHE_MAX_ITEM_BYTES)
+
+
+def invalidate_lookup_caches():
+    """Make all worker processes drop their lookup caches."""
+    INTERFACE_TEMPLATES_CACHE.clear()
+    VRF_CACHE.clear()
+    cache.set(LOOKUP_CACHE_VERSION_KEY, uuid4().hex, None)
@@ -0,0 +1,31 @@
+"""Index device config changes of configs repository history and link them to devices."""
+
+from django.core.management.base import BaseCommand
+from config_officer.models import ConfigChange
+from config_officer.worker import BULK_BATCH_SIZE, get_devices_by_hostname, index_config_changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Index device config changes of commits made after the last indexed one "
+        "and link indexed changes to devices added or renamed since."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full", action="store_true", help="Read the whole repository history, indexed changes are skipped"
+        )
+
+    def handle(self, *args, **options):
+        count = index_config_changes(full=options["full"])
+        self.stdout.write(f"{count} config changes read from repository history")
+
+        unlinked = list(ConfigChange.objects.filter(device__isnull=True).only("pk", "hostname"))
+        devices = get_devices_by_hostname({change.hostname for change in unlinked})
+        linked = []
+        for change in unlinked:
+            change.device_id = devices.get(change.hostname)
+            if change.device_id:
+                linked.append(change)
+        ConfigChange.objects.bulk_update(linked, ["device"], batch_size=BULK_BATCH_SIZE)
+        self.stdout.write(self.style.SUCCESS(f"{len(linked)} config changes linked to devices"))
@@ -0,0 +1,124 @@
+"""Move device config files to another directory layout of configs repository, preserving git history."""
+
+import os
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from git import Repo
+from dcim.models import Device
+from config_officer.git_manager import (
+    CONFIGS_LAYOUT,
+    CONFIGS_LAYOUTS,
+    RESHARD_COMMIT_MESSAGE,
+    get_config_path,
+    parse_config_filename,
+)
+
+PLUGIN_SETTINGS = settings.PLUGINS_CONFIG.get("config_officer", dict())
+NETBOX_DEVICES_CONFIGS_DIR = PLUGIN_SETTINGS.get("NETBOX_DEVICES_CONFIGS_DIR", "/device_configs")
+# Max paths passed to one git command
+GIT_PATHS_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        "Move device config files to CONFIGS_LAYOUT directory layout with git mv, so history is kept. "
+        "Stop RQ workers before running it and set CONFIGS_LAYOUT afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--layout", choices=CONFIGS_LAYOUTS, default=CONFIGS_LAYOUT, help="Target layout, CONFIGS_LAYOUT by default"
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Show moves without changing the repository")
+
+    @staticmethod
+    def get_commit_time(repo, path):
+        """Time of the last commit of the file."""
+        return int(repo.git.log("-1", "--format=%ct", "--", path) or 0)
+
+    def handle(self, *args, **options):
+        layout = options["layout"]
+        repo = Repo(NETBOX_DEVICES_CONFIGS_DIR)
+        if repo.is_dirty(untracked_files=False):
+            raise CommandError("Configs repository has uncommitted changes, commit them first")
+
+        # Config file names are not guaranteed to have device name case
+        sites = {name.lower(): site for name, site in Device.objects.values_list("name", "site__slug")}
+        # Device moved to another site in "site" layout has an old file in the former site directory
+        files = defaultdict(list)
+        for path in repo.git.ls_files("-z").split("\0"):
+            parsed = parse_config_filename(path)
+            if parsed:
+                hostname, config_type = parsed
+                files[(hostname.lower(), config_type)].append((hostname, path))
+        stale = []
+        for (name, config_type), paths in files.items():
+            if len(paths) > 1:
+                paths.sort(key=lambda item: self.get_commit_time(repo, item[1]), reverse=True)
+                self.stderr.write(
+                    self.style.WARNING(
+                        f"{len(paths)} files of {name} {config_type} config, keeping the newest {paths[0][1]}"
+                    )
+                )
+                stale.extend(path for _, path in paths[1:])
+
+        # git mv moves many files into one directory at once. Files renamed on the way are moved one by one.
+        moves_to_dir = defaultdict(list)
+        renames = []
+        targets = set()
+        for (name, config_type), paths in files.items():
+            hostname, path = paths[0]
+            target = get_config_path(hostname, config_type, site=sites.get(name) or "", layout=layout)
+            if target in targets:
+                raise CommandError(f"{path} and another file are both moved to {target}")
+            targets.add(target)
+            if target == path:
+                continue
+            if os.path.basename(target) == os.path.basename(path):
+                moves_to_dir[os.path.dirname(target)].append(path)
+            else:
+                renames.append((path, target))
+
+        count = sum(len(paths) for paths in moves_to_dir.values()) + len(renames)
+        if options["dry_run"]:
+            for directory, paths in moves_to_dir.items():
+                for path in paths:
+                    self.stdout.write(f"{path} -> {os.path.join(directory, os.path.basename(path))}")
+            for path, target in renames:
+                self.stdout.write(f"{path} -> {target}")
+            for path in stale:
+                self.stdout.write(f"{path} would be removed")
+            self.stdout.write(f"{count} files would be moved to {layout} layout, {len(stale)} stale files removed")
+            return
+        if not count and not stale:
+            self.stdout.write(f"All device configs are in {layout} layout already")
+            return
+
+        source_dirs = set()
+        for i in range(0, len(stale), GIT_PATHS_BATCH_SIZE):
+            repo.git.rm("-q", "--", *stale[i:i + GIT_PATHS_BATCH_SIZE])
+        source_dirs.update(os.path.dirname(path) for path in stale)
+        for directory, paths in moves_to_dir.items():
+            os.makedirs(os.path.join(NETBOX_DEVICES_CONFIGS_DIR, directory), exist_ok=True)
+            for i in range(0, len(paths), GIT_PATHS_BATCH_SIZE):
+                repo.git.mv("--", *paths[i:i + GIT_PATHS_BATCH_SIZE], directory or ".")
+            source_dirs.update(os.path.dirname(path) for path in paths)
+        for path, target in renames:
+            os.makedirs(os.path.join(NETBOX_DEVICES_CONFIGS_DIR, os.path.dirname(target)), exist_ok=True)
+            repo.git.mv("--", path, target)
+            source_dirs.add(os.path.dirname(path))
+
+        # Shard directories left empty
+        for directory in source_dirs - {""}:
+            try:
+                os.removedirs(os.path.join(NETBOX_DEVICES_CONFIGS_DIR, directory))
+            except OSError:
+                pass
+
+        repo.git.commit("-m", RESHARD_COMMIT_MESSAGE, author="Netbox Netbox <netbox@example.com>")
+        self.stdout.write(
+            self.style.SUCCESS(f"{count} files moved to {layout} layout, {len(stale)} stale files removed")
+        )
+        if layout != CONFIGS_LAYOUT:
+            self.stdout.write(f'Set "CONFIGS_LAYOUT": "{layout}" in PLUGINS_CONFIG before starting workers')
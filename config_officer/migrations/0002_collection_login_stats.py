@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('config_officer', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='login_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='collection',
+            name='login_time_saved',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dcim', '0122_standardize_name_length'),
+        ('config_officer', '0002_collection_login_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceCollectionState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('transport', models.CharField(blank=True, max_length=50, null=True)),
+                ('port', models.PositiveIntegerField(blank=True, null=True)),
+                ('platform', models.CharField(blank=True, max_length=50, null=True)),
+                ('device', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='collection_state', to='dcim.device')),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('config_officer', '0003_devicecollectionstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='devicecollectionstate',
+            name='config_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='devicecollectionstate',
+            name='last_collected',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='collection',
+            name='config_changed',
+            field=models.BooleanField(blank=True, null=True),
+        ),
+    ]
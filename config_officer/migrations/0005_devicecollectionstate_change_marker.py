@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('config_officer', '0004_config_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='devicecollectionstate',
+            name='change_marker',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('config_officer', '0005_devicecollectionstate_change_marker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='parse_time',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('config_officer', '0006_collection_parse_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollectionRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('commit_msg', models.CharField(blank=True, max_length=255)),
+                ('total', models.IntegerField(default=0)),
+                ('pending', models.IntegerField(default=0)),
+                ('running', models.IntegerField(default=0)),
+                ('succeeded', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-started'],
+            },
+        ),
+        migrations.AddField(
+            model_name='collection',
+            name='run',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='config_officer.collectionrun'),
+        ),
+    ]
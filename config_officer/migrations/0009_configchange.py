@@ -0,0 +1,39 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dcim', '0122_standardize_name_length'),
+        ('config_officer', '0008_collection_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConfigChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('hostname', models.CharField(max_length=255)),
+                ('config_type', models.CharField(default='running', max_length=50)),
+                ('commit', models.CharField(max_length=40)),
+                ('date', models.DateTimeField()),
+                ('message', models.CharField(blank=True, max_length=512)),
+                ('added', models.PositiveIntegerField(default=0)),
+                ('deleted', models.PositiveIntegerField(default=0)),
+                ('device', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='config_changes', to='dcim.device')),
+            ],
+            options={
+                'ordering': ['-date', '-pk'],
+                'unique_together': {('commit', 'hostname', 'config_type')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='configchange',
+            index=models.Index(fields=['hostname', 'config_type', '-date'], name='co_configchange_host_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='configchange',
+            index=models.Index(fields=['-date'], name='co_configchange_date_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('config_officer', '0009_configchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='configchange',
+            name='run',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='config_changes', to='config_officer.collectionrun'),
+        ),
+    ]
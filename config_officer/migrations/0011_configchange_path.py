@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('config_officer', '0010_configchange_run'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='configchange',
+            name='path',
+            field=models.CharField(blank=True, max_length=512),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('config_officer', '0011_configchange_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='devicecollectionstate',
+            name='config_path',
+            field=models.CharField(blank=True, max_length=512, null=True),
+        ),
+    ]
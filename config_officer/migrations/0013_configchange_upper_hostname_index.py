@@ -0,0 +1,26 @@
+import django.db.models.expressions
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('config_officer', '0012_devicecollectionstate_config_path'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='configchange',
+            name='co_configchange_host_idx',
+        ),
+        migrations.AddIndex(
+            model_name='configchange',
+            index=models.Index(
+                django.db.models.functions.text.Upper('hostname'),
+                models.F('config_type'),
+                django.db.models.expressions.OrderBy(models.F('date'), descending=True),
+                name='co_configchange_uhost_idx',
+            ),
+        ),
+    ]
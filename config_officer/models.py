@@ -10,7 +10,40 @@ from .choices import (
     
 )
 from .config_manager import generate_templates_config_for_device
-from django.db.models import Q
+from django.db.models import F, Q
+from django.db.models.functions import Upper
+from django.utils import timezone
+
+
+class CollectionRun(models.Model):
+    """Global collection run with aggregated progress counters."""
+
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    commit_msg = models.CharField(max_length=255, blank=True)
+    total = models.IntegerField(default=0)
+    pending = models.IntegerField(default=0)
+    running = models.IntegerField(default=0)
+    succeeded = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.started:%Y-%m-%d %H:%M:%S}"
+
+    @property
+    def is_active(self):
+        return self.finished is None
+
+    @property
+    def throughput(self):
+        """Collected devices per minute."""
+        minutes = ((self.finished or timezone.now()) - self.started).total_seconds() / 60
+        if minutes <= 0:
+            return 0
+        return round((self.succeeded + self.failed) / minutes, 1)
+
+    class Meta:
+        ordering = ["-started"]
 
 
 class Collection(models.Model):
@@ -19,6 +52,9 @@ class Collection(models.Model):
     device = models.ForeignKey(
         to="dcim.Device", on_delete=models.SET_NULL, blank=True, null=True
     )
+    run = models.ForeignKey(
+        to="CollectionRun", on_delete=models.CASCADE, blank=True, null=True, related_name="tasks"
+    )
     status = models.CharField(
         max_length=255,
         choices=CollectStatusChoices,
@@ -28,6 +64,10 @@ class Collection(models.Model):
     message = models.CharField(max_length=512, blank=True, null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     failed_reason = models.CharField(max_length=255, choices=CollectFailChoices, null=True)
+    login_count = models.PositiveSmallIntegerField(default=0)
+    login_time_saved = models.FloatField(blank=True, null=True)
+    config_changed = models.BooleanField(blank=True, null=True)
+    parse_time = models.FloatField(default=0)
     
     csv_headers = [
         "device",
@@ -41,6 +81,70 @@ class Collection(models.Model):
 
     class Meta:
         ordering = ["timestamp"]
+        # CollectionFilter fields and retention pruning
+        indexes = [
+            models.Index(fields=["status"], name="co_collection_status_idx"),
+            models.Index(fields=["failed_reason"], name="co_collection_failed_idx"),
+            models.Index(fields=["timestamp"], name="co_collection_timestamp_idx"),
+            models.Index(fields=["run", "status"], name="co_collection_run_status_idx"),
+        ]
+
+
+class DeviceCollectionState(models.Model):
+    """Device connection details that worked during the last collection."""
+
+    device = models.OneToOneField(to="dcim.Device", on_delete=models.CASCADE, related_name="collection_state")
+    transport = models.CharField(max_length=50, blank=True, null=True)
+    port = models.PositiveIntegerField(blank=True, null=True)
+    platform = models.CharField(max_length=50, blank=True, null=True)
+    config_hash = models.CharField(max_length=64, blank=True, null=True)
+    change_marker = models.CharField(max_length=255, blank=True, null=True)
+    last_collected = models.DateTimeField(blank=True, null=True)
+    # Running config file path relative to configs repository, it changes with device site in "site" layout
+    config_path = models.CharField(max_length=512, blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.device}:{self.transport}:{self.port}"
+
+
+class ConfigChangeQuerySet(models.QuerySet):
+    def for_hostname(self, hostname):
+        """Changes of the hostname in any case. Unlike hostname__iexact, the lookup is served by the index."""
+        return self.annotate(hostname_upper=Upper("hostname")).filter(hostname_upper=hostname.upper())
+
+
+class ConfigChange(models.Model):
+    """Change of a device config file made by one commit of configs git repository."""
+
+    device = models.ForeignKey(
+        to="dcim.Device", on_delete=models.SET_NULL, blank=True, null=True, related_name="config_changes"
+    )
+    run = models.ForeignKey(
+        to="CollectionRun", on_delete=models.SET_NULL, blank=True, null=True, related_name="config_changes"
+    )
+    hostname = models.CharField(max_length=255)
+    config_type = models.CharField(max_length=50, default="running")
+    # File path in repository at the time of commit
+    path = models.CharField(max_length=512, blank=True)
+    commit = models.CharField(max_length=40)
+    date = models.DateTimeField()
+    message = models.CharField(max_length=512, blank=True)
+    added = models.PositiveIntegerField(default=0)
+    deleted = models.PositiveIntegerField(default=0)
+
+    objects = ConfigChangeQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.hostname}:{self.commit[:8]}"
+
+    class Meta:
+        ordering = ["-date", "-pk"]
+        unique_together = [["commit", "hostname", "config_type"]]
+        indexes = [
+            # Config file hostname case may differ from the device name, changes are looked up case insensitive
+            models.Index(Upper("hostname"), F("config_type"), F("date").desc(), name="co_configchange_uhost_idx"),
+            models.Index(fields=["-date"], name="co_configchange_date_idx"),
+        ]
 
 
 class Template(models.Model):
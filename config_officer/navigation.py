@@ -15,6 +15,10 @@ menu_items = (
             
         )         
     ),      
+    PluginMenuItem(
+        link='plugins:config_officer:config_changes',
+        link_text='Device config changes',
+    ),
     PluginMenuItem(
         link='plugins:config_officer:template_list',
         link_text='Templates configuration',
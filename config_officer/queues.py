@@ -0,0 +1,25 @@
+"""RQ queues of config_officer jobs."""
+
+from django.conf import settings
+from django_rq import get_queue
+
+PLUGIN_SETTINGS = settings.PLUGINS_CONFIG.get("config_officer", dict())
+# Job class -> RQ queue name. Queues must be defined in RQ_QUEUES and served by workers.
+# All classes are in "default" queue, served by any NetBox worker. Single device collection and history pruning
+# are put at the front of their queue, so they don't wait behind global collection jobs.
+QUEUES = {
+    # global collection: orchestration, per-device/chunk/asyncio jobs
+    "collection": "default",
+    # single device collection started by a user
+    "interactive": "default",
+    "compliance": "default",
+    "git": "default",
+    # collection history pruning
+    "maintenance": "default",
+    **PLUGIN_SETTINGS.get("QUEUES", dict()),
+}
+
+
+def get_job_queue(job_class):
+    """RQ queue for the job class."""
+    return get_queue(QUEUES[job_class])
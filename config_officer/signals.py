@@ -0,0 +1,15 @@
+"""Signals for config_officer plugin."""
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from dcim.models import DeviceType, InterfaceTemplate
+from ipam.models import VRF
+from .lookup_cache import invalidate_lookup_caches
+
+
+@receiver([post_save, post_delete], sender=DeviceType)
+@receiver([post_save, post_delete], sender=InterfaceTemplate)
+@receiver([post_save, post_delete], sender=VRF)
+def invalidate_lookup_caches_handler(sender, **kwargs):
+    """Drop cached interface templates and VRFs."""
+    invalidate_lookup_caches()
@@ -5,7 +5,8 @@ from utilities.tables import BaseTable, ToggleColumn, ColoredLabelColumn, TagCol
 from .models import (
     Collection, 
     Template,
-    Service
+    Service,
+    ConfigChange
 )
 from tenancy.tables import TenantColumn
 from django_tables2.utils import Accessor
@@ -30,6 +31,14 @@ TEMPLATE_LINK = """
 </a>
 """
 
+CONFIG_CHANGE_HOSTNAME = """
+<a href="{% url 'plugins:config_officer:running_config' hostname=record.hostname %}">
+    {{ record.hostname }}
+</a>
+"""
+
+CONFIG_CHANGE_COMMIT = """<code>{{ record.commit|truncatechars:9 }}</code>"""
+
 DESCRIPTION = """{{ record.description|default:"&mdash;" }}"""
 
 TEMPLATE_TEXT = """
@@ -156,7 +165,11 @@ class CollectionTable(BaseTable):
             'device',
             'status',
             'failed_reason',
-            'message',            
+            'message',
+            'login_count',
+            'login_time_saved',
+            'config_changed',
+            'parse_time',
         )
 
 
@@ -295,3 +308,42 @@ class ServiceMappingListTable(BaseTable):
             "status",
             "notes"
         )
+
+
+class ConfigChangeTable(BaseTable):
+    hostname = tables.TemplateColumn(
+        template_code=CONFIG_CHANGE_HOSTNAME,
+        verbose_name='Hostname',
+    )
+    site = tables.Column(
+        accessor=Accessor('device__site'),
+        linkify=True,
+        verbose_name='Site',
+    )
+    role = tables.Column(
+        accessor=Accessor('device__device_role'),
+        linkify=True,
+        verbose_name='Role',
+    )
+    tenant = TenantColumn(
+        accessor=Accessor('device__tenant'),
+    )
+    commit = tables.TemplateColumn(
+        template_code=CONFIG_CHANGE_COMMIT,
+        verbose_name='Commit',
+    )
+
+    class Meta(BaseTable.Meta):
+        model = ConfigChange
+        fields = (
+            'date',
+            'hostname',
+            'site',
+            'role',
+            'tenant',
+            'commit',
+            'message',
+            'added',
+            'deleted',
+            'run',
+        )
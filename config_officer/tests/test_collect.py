@@ -0,0 +1,77 @@
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from dcim.models import Device, DeviceRole, DeviceType, Interface, Manufacturer, Site
+from ipam.models import IPAddress, VRF
+from config_officer.collect import CollectDeviceData, DeviceInterface
+from config_officer.lookup_cache import INTERFACE_TEMPLATES_CACHE, VRF_CACHE
+from config_officer.models import Collection
+
+
+class InterfaceReconcileTestCase(TestCase):
+    """update_interfaces_in_netbox() applies the device state with a fixed number of queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.site = Site.objects.create(name="Site 1", slug="site-1")
+        manufacturer = Manufacturer.objects.create(name="Cisco", slug="cisco")
+        cls.device_type = DeviceType.objects.create(manufacturer=manufacturer, model="ISR4331", slug="isr4331")
+        cls.device_role = DeviceRole.objects.create(name="Router", slug="router")
+        VRF.objects.create(name="CUST-A")
+        VRF.objects.create(name="CUST-B")
+
+    def setUp(self):
+        ContentType.objects.get_for_model(Interface)
+
+    def get_collector(self, name, interfaces_count, vrf="CUST-A"):
+        device = Device.objects.create(
+            name=name, site=self.site, device_type=self.device_type, device_role=self.device_role
+        )
+        collector = CollectDeviceData(Collection.objects.create(device=device), ip="192.0.2.1", hostname_ipam=name)
+        collector.pid = "isr4331"
+        for i in range(interfaces_count):
+            interface = DeviceInterface(
+                name=f"GigabitEthernet0/0/{i}",
+                address=f"10.{i // 256}.{i % 256}.1/24",
+                description=f"uplink {i}",
+                vrf=vrf,
+            )
+            interface.secondary = [f"172.16.{i}.1/24"]
+            collector.interfaces[interface.name] = interface
+        # Every reconcile starts with cold lookup caches
+        INTERFACE_TEMPLATES_CACHE.clear()
+        VRF_CACHE.clear()
+        return collector
+
+    def test_queries_do_not_grow_with_interfaces(self):
+        small = self.get_collector("router1", 2)
+        with CaptureQueriesContext(connection) as queries:
+            small.update_interfaces_in_netbox()
+
+        large = self.get_collector("router2", 50)
+        with self.assertNumQueries(len(queries.captured_queries)):
+            large.update_interfaces_in_netbox()
+
+        self.assertEqual(Interface.objects.filter(device=large.task.device).count(), 50)
+        self.assertEqual(IPAddress.objects.filter(interface__device=large.task.device).count(), 100)
+
+    def test_unchanged_device_is_not_written(self):
+        collector = self.get_collector("router1", 10)
+        collector.update_interfaces_in_netbox()
+        with CaptureQueriesContext(connection) as queries:
+            collector.update_interfaces_in_netbox()
+        statements = [query["sql"].split()[0].upper() for query in queries.captured_queries]
+        self.assertNotIn("INSERT", statements)
+        self.assertNotIn("UPDATE", statements)
+        self.assertNotIn("DELETE", statements)
+
+    def test_secondary_address_follows_interface_vrf(self):
+        collector = self.get_collector("router1", 3)
+        collector.update_interfaces_in_netbox()
+        for interface in collector.interfaces.values():
+            interface.vrf = "CUST-B"
+        collector.update_interfaces_in_netbox()
+
+        secondary = IPAddress.objects.filter(interface__device=collector.task.device, address="172.16.1.1/24")
+        self.assertEqual(secondary.get().vrf.name, "CUST-B")
@@ -0,0 +1,57 @@
+import asyncio
+import os
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from django.test import TestCase
+from config_officer.collect import CollectDeviceData
+from config_officer.worker import ASYNC_COLLECTION_CONCURRENCY
+
+# Comma separated "host" or "host:platform" of lab devices, credentials are taken from PLUGINS_CONFIG
+BENCHMARK_HOSTS = [host for host in os.environ.get("CONFIG_OFFICER_BENCHMARK_HOSTS", "").split(",") if host]
+# RQ workers serving the job per device mode
+BENCHMARK_WORKERS = int(os.environ.get("CONFIG_OFFICER_BENCHMARK_WORKERS", 10))
+
+
+def make_collector(host):
+    ip, _, platform = host.partition(":")
+    task = SimpleNamespace(device=None, login_count=0, parse_time=0)
+    return CollectDeviceData(task, ip=ip, hostname_ipam=ip, platform=platform or "iosxe")
+
+
+@unittest.skipUnless(BENCHMARK_HOSTS, "Set CONFIG_OFFICER_BENCHMARK_HOSTS to run collection benchmark")
+class CollectionModeBenchmark(TestCase):
+    """Devices per minute of "job" and "asyncio" collection modes against lab devices.
+
+    Only device sessions are measured (show version, interfaces and running config), NetBox and git updates
+    are the same in both modes. "job" mode is a pool of BENCHMARK_WORKERS threads collecting one device
+    at a time, like RQ worker processes do - the session time is spent waiting for devices.
+    """
+
+    def report(self, mode, collectors, elapsed):
+        per_minute = len(collectors) / elapsed * 60
+        print(f"\n{mode}: {len(collectors)} devices in {elapsed:.1f} s, {per_minute:.1f} devices/min")
+        return per_minute
+
+    def test_job_mode(self):
+        collectors = [make_collector(host) for host in BENCHMARK_HOSTS]
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=BENCHMARK_WORKERS) as pool:
+            list(pool.map(lambda collector: collector.fetch_information(), collectors))
+        self.report(f"job, {BENCHMARK_WORKERS} workers", collectors, time.monotonic() - started)
+
+    def test_asyncio_mode(self):
+        collectors = [make_collector(host) for host in BENCHMARK_HOSTS]
+        semaphore = asyncio.Semaphore(ASYNC_COLLECTION_CONCURRENCY)
+
+        async def fetch(collector):
+            async with semaphore:
+                return await collector.fetch_information_async()
+
+        async def fetch_all():
+            return await asyncio.gather(*[fetch(collector) for collector in collectors])
+
+        started = time.monotonic()
+        asyncio.run(fetch_all())
+        self.report(f"asyncio, concurrency {ASYNC_COLLECTION_CONCURRENCY}", collectors, time.monotonic() - started)
@@ -0,0 +1,23 @@
+from django.test import SimpleTestCase
+from config_officer.lookup_cache import SizedLookupCache
+
+
+class SizedLookupCacheTestCase(SimpleTestCase):
+    def test_least_recently_used_values_are_evicted_by_size(self):
+        cache = SizedLookupCache(maxbytes=10, maxitem=6)
+        cache.set("a", "x" * 4)
+        cache.set("b", "y" * 4)
+        cache.get("a")
+        cache.set("c", "z" * 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "x" * 4)
+        self.assertEqual(cache.size, 7)
+
+    def test_large_values_are_not_cached(self):
+        cache = SizedLookupCache(maxbytes=10, maxitem=6)
+        cache.set("a", "x" * 4)
+        cache.set("b", "y" * 7)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "x" * 4)
@@ -0,0 +1,110 @@
+import os
+import time
+import unittest
+from types import SimpleNamespace
+from django.test import SimpleTestCase
+from config_officer.collect import CiscoDevice
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+# Outputs of SHOW_INTERFACES_COMMANDS, in the same order
+SHOW_INTERFACES_FIXTURES = ["show_ip_interface_brief.txt", "show_ip_interface.txt", "show_interfaces.txt"]
+# Subinterfaces of the generated output of a large chassis
+LARGE_DEVICE_SUBINTERFACES = 4000
+
+
+def load_outputs(device):
+    """Recorded outputs of SHOW_INTERFACES_COMMANDS as scrapli responses."""
+    outputs = []
+    for filename in SHOW_INTERFACES_FIXTURES:
+        with open(os.path.join(FIXTURES_DIR, device, filename)) as file:
+            outputs.append(SimpleNamespace(result=file.read()))
+    return outputs
+
+
+def make_large_outputs(count=LARGE_DEVICE_SUBINTERFACES):
+    """Outputs of a chassis with `count` L3VPN subinterfaces, made of the recorded subinterface sections."""
+    brief, ip_interface, interfaces = [output.result for output in load_outputs("iosxe_small")]
+    brief_lines, ip_sections, sections = [brief], [ip_interface], [interfaces]
+    for i in range(count):
+        name = f"GigabitEthernet0/1/{i // 4000}.{i % 4000 + 1}"
+        address = f"10.{128 + i // 65536 % 128}.{i // 256 % 256}.{i % 256}"
+        brief_lines.append(f"{name:<24} {address:<15} YES NVRAM  up                    up\n")
+        ip_sections.append(
+            f"{name} is up, line protocol is up\n"
+            f"  Internet address is {address}/31\n"
+            f"  MTU is 1500 bytes\n"
+            f'  VPN Routing/Forwarding "CUST-{i % 50}"\n'
+        )
+        sections.append(
+            f"{name} is up, line protocol is up \n"
+            f"  Hardware is ISR4331-3x1GE, address is 00a3.d14f.2b00 (bia 00a3.d14f.2b00)\n"
+            f"  Description: customer {i}\n"
+        )
+    return [SimpleNamespace(result="".join(parts)) for parts in (brief_lines, ip_sections, sections)]
+
+
+def make_device(host="192.0.2.1"):
+    device = CiscoDevice(task=SimpleNamespace(parse_time=0))
+    device.device = {"host": host}
+    return device
+
+
+class ParseShowInterfacesTestCase(SimpleTestCase):
+    def test_recorded_outputs(self):
+        device = make_device()
+        device.parse_show_interfaces(load_outputs("iosxe_small"))
+
+        self.assertEqual(
+            list(device.interfaces),
+            ["GigabitEthernet0/0/0", "GigabitEthernet0/0/1", "GigabitEthernet0/0/1.100", "Loopback0"],
+        )
+        self.assertEqual(device.mgmt_if, "GigabitEthernet0/0/0")
+
+        lan = device.interfaces["GigabitEthernet0/0/0"]
+        self.assertEqual(lan.address, "192.0.2.1/24")
+        self.assertEqual(lan.secondary, ["192.0.2.129/25"])
+        self.assertEqual(lan.mac, "00a3.d14f.2a00")
+        self.assertEqual(lan.description, "LAN")
+        self.assertFalse(lan.dhcp)
+
+        uplink = device.interfaces["GigabitEthernet0/0/1"]
+        self.assertTrue(uplink.dhcp)
+        self.assertFalse(hasattr(uplink, "vrf"))
+
+        subinterface = device.interfaces["GigabitEthernet0/0/1.100"]
+        self.assertEqual(subinterface.mtu, 1496)
+        self.assertEqual(subinterface.vrf, "CUST-A")
+        self.assertEqual(subinterface.description, "CUST-A L3VPN")
+
+        loopback = device.interfaces["Loopback0"]
+        self.assertEqual(loopback.address, "10.255.0.1/32")
+        self.assertFalse(hasattr(loopback, "mac"))
+
+    def test_generated_large_outputs(self):
+        device = make_device()
+        device.parse_show_interfaces(make_large_outputs(100))
+
+        self.assertEqual(len(device.interfaces), 104)
+        subinterface = device.interfaces["GigabitEthernet0/1/0.100"]
+        self.assertEqual(subinterface.address, "10.128.0.99/31")
+        self.assertEqual(subinterface.vrf, "CUST-49")
+        self.assertEqual(subinterface.description, "customer 99")
+
+
+@unittest.skipUnless(os.environ.get("CONFIG_OFFICER_BENCHMARK"), "Set CONFIG_OFFICER_BENCHMARK=1 to run benchmarks")
+class ParseShowInterfacesBenchmark(SimpleTestCase):
+    """Parse time of recorded small device outputs and generated large chassis outputs."""
+
+    def benchmark(self, name, outputs, repeat):
+        lines = sum(output.result.count("\n") for output in outputs)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            make_device().parse_show_interfaces(outputs)
+        elapsed = (time.perf_counter() - started) / repeat
+        print(f"\n{name}: {lines} lines parsed in {elapsed * 1000:.2f} ms, {lines / elapsed:,.0f} lines/s")
+
+    def test_small_device(self):
+        self.benchmark("iosxe_small", load_outputs("iosxe_small"), repeat=1000)
+
+    def test_large_device(self):
+        self.benchmark(f"{LARGE_DEVICE_SUBINTERFACES} subinterfaces", make_large_outputs(), repeat=10)
@@ -0,0 +1,31 @@
+import pickle
+from unittest import mock
+from django.test import TestCase
+from dcim.models import Device, DeviceRole, DeviceType, Manufacturer, Site
+from config_officer.models import Collection
+from config_officer.worker import succeed_collect_task
+
+# Job arguments are pickled into redis, a device id is a few bytes while a pickled Device is kilobytes
+MAX_COMPLIANCE_JOB_PAYLOAD = 200
+
+
+class ComplianceJobPayloadTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        site = Site.objects.create(name="Site 1", slug="site-1")
+        manufacturer = Manufacturer.objects.create(name="Cisco", slug="cisco")
+        device_type = DeviceType.objects.create(manufacturer=manufacturer, model="ISR4331", slug="isr4331")
+        device_role = DeviceRole.objects.create(name="Router", slug="router")
+        cls.device = Device.objects.create(name="router1", site=site, device_type=device_type, device_role=device_role)
+
+    def test_compliance_job_gets_device_id(self):
+        task = Collection.objects.create(device=self.device, config_changed=True)
+        with mock.patch("config_officer.worker.get_job_queue") as get_job_queue:
+            succeed_collect_task(task, mock.Mock(), save=False)
+
+        get_job_queue.assert_called_once_with("compliance")
+        (func_name, *args), kwargs = get_job_queue.return_value.enqueue.call_args
+        self.assertEqual(kwargs, {"device_id": self.device.pk})
+        # The same tuple RQ serializes as the job data
+        payload = pickle.dumps((func_name, None, tuple(args), kwargs), protocol=pickle.HIGHEST_PROTOCOL)
+        self.assertLess(len(payload), MAX_COMPLIANCE_JOB_PAYLOAD)
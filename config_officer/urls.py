@@ -42,5 +42,7 @@ urlpatterns = [
 
     #Show running-config information page
     path("running_config/<slug:hostname>/", views.running_config, name="running_config"),    
+    path("running_config/<slug:hostname>/diff/<str:commit>/", views.config_diff, name="config_diff"),
+    path("config_changes/", views.ConfigChangeListView.as_view(), name="config_changes"),
 ]   
 
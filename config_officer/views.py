@@ -1,12 +1,11 @@
 """Views for config_officer plugin."""
 
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404
 from django.views.generic import View
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from dcim.models import Device
-from django_rq import get_queue
 from django.shortcuts import render, get_object_or_404, redirect
-from django_rq import get_queue
+from .queues import get_job_queue
 from django.contrib import messages
 from django.urls import reverse
 from netbox.views.generic import (
@@ -17,13 +16,15 @@ from netbox.views.generic import (
 )
 from .models import (
     Collection, 
+    CollectionRun,
     Template, 
     Service,
     ServiceRule,
     ServiceMapping,
-    Compliance   
+    Compliance,
+    ConfigChange
 )
-from .filters import CollectionFilter, ServiceMappingFilter
+from .filters import CollectionFilter, ServiceMappingFilter, ConfigChangeFilter
 from .forms import (
     CollectionFilterForm, 
     TemplateForm,
@@ -31,43 +32,56 @@ from .forms import (
     ServiceRuleForm,  
     ServiceMappingForm,
     ServiceMappingCreateForm,
-    ServiceMappingFilterForm
+    ServiceMappingFilterForm,
+    ConfigChangeFilterForm
 )
 from .tables import (
     CollectionTable, 
     TemplateListTable,
     ServiceListTable,
     ServiceRuleListTable,
-    ServiceMappingListTable
+    ServiceMappingListTable,
+    ConfigChangeTable
 )
 from .choices import CollectStatusChoices
-from .git_manager import get_device_config, get_config_update_date, get_file_repo_state
+from .git_manager import get_device_config, get_config_update_date, get_file_diff, get_config_path
+from .lookup_cache import DIFF_CACHE
 from copy import deepcopy
-from datetime import datetime
+from datetime import datetime, timedelta
+from django.utils import timezone
 import pytz
 import os 
 import io 
 import xlsxwriter
-from django.db.models import Q
+from django.db.models import Count, Min, Max
+from django.core.paginator import Paginator
 from django.conf import settings
 
 PLUGIN_SETTINGS = settings.PLUGINS_CONFIG.get("config_officer", dict())
 NETBOX_DEVICES_CONFIGS_DIR = PLUGIN_SETTINGS.get("NETBOX_DEVICES_CONFIGS_DIR", "/device_configs")
 TIME_ZONE = os.environ.get("TIME_ZONE", "UTC")
+COLLECTION_JOB_TIMEOUT = PLUGIN_SETTINGS.get("COLLECTION_JOB_TIMEOUT", 6 * 3600)
+CONFIG_CHANGES_PAGE_SIZE = PLUGIN_SETTINGS.get("CONFIG_CHANGES_PAGE_SIZE", 10)
+
+
+def get_active_collection_run():
+    """Unfinished collection run. Runs older than COLLECTION_JOB_TIMEOUT are considered dead."""
+
+    return CollectionRun.objects.filter(
+        finished__isnull=True, started__gte=timezone.now() - timedelta(seconds=COLLECTION_JOB_TIMEOUT)
+    ).first()
 
 
 def global_collection():
     """Function for collect all devices running-configs."""
 
-    devices_collecting = Collection.objects.filter(
-        Q(status__iexact=CollectStatusChoices.STATUS_PENDING)
-        | Q(status__iexact=CollectStatusChoices.STATUS_RUNNING)
-    )
-    count = len(devices_collecting)
-    if count > 0:
+    run = get_active_collection_run()
+    if run:
+        count = run.pending + run.running
         return f"Global collection not possible now. There are {count} devices are in {CollectStatusChoices.STATUS_PENDING} or {CollectStatusChoices.STATUS_RUNNING} state"
     else:
-        get_queue("default").enqueue("config_officer.worker.collect_all_devices_configs")
+        run = CollectionRun.objects.create()
+        get_job_queue("collection").enqueue("config_officer.worker.collect_all_devices_configs", run_id=run.pk)
         return "Global sync was started"
 
 
@@ -88,7 +102,15 @@ class CollectStatusListView(PermissionRequiredMixin, ObjectListView):
     filterset_form = CollectionFilterForm
     table = CollectionTable
     template_name = "config_officer/collect_configs_list.html"
-    
+
+    def extra_context(self):
+        collection_run = CollectionRun.objects.first()
+        deadline = timezone.now() - timedelta(seconds=COLLECTION_JOB_TIMEOUT)
+        if collection_run and collection_run.is_active and collection_run.started < deadline:
+            # Jobs of the run were killed or timed out
+            get_job_queue("git").enqueue("config_officer.worker.finalize_expired_runs")
+        return {"collection_run": collection_run}
+
     # def post(self, request, *args, **kwargs):
     #     if "reCollect" in request.POST:
     #         pk_list = [int(pk) for pk in request.POST.getlist("pk")]
@@ -139,7 +161,9 @@ def collect_device_config(request, slug):
     else:
         message = "Ok"
         try:
-            get_queue("default").enqueue("config_officer.worker.collect_device_config_hostname", hostname=slug)
+            get_job_queue("interactive").enqueue(
+                "config_officer.worker.collect_device_config_hostname", hostname=slug, at_front=True
+            )
             return redirect(reverse('plugins:config_officer:collection_status'))
         except Exception as e:
             message = e
@@ -283,8 +307,9 @@ class ComplianceView(PermissionRequiredMixin, View):
 
     def get(self, request, device):
         record = get_object_or_404(self.queryset, device=device)
-        device_config = get_device_config(NETBOX_DEVICES_CONFIGS_DIR, record.device.name, "running")
-        config_update_date = get_config_update_date(NETBOX_DEVICES_CONFIGS_DIR, record.device.name, "running")
+        site = record.device.site.slug
+        device_config = get_device_config(NETBOX_DEVICES_CONFIGS_DIR, record.device.name, "running", site=site)
+        config_update_date = get_config_update_date(NETBOX_DEVICES_CONFIGS_DIR, record.device.name, "running", site=site)
         return render(
             request,
             "config_officer/compliance_view.html",
@@ -399,7 +424,7 @@ class ServiceMappingListView(PermissionRequiredMixin, ObjectListView):
                         for service in services:
                             ServiceMapping.objects.update_or_create(device=device, service=service)                                          
                         # Check compliance right after services are assigned:
-                        get_queue("default").enqueue("config_officer.worker.check_device_config_compliance", device=device)
+                        get_job_queue("compliance").enqueue("config_officer.worker.check_device_config_compliance", device_id=device.pk)
 
                     messages.success(request, f'{services} were attached to {len(data["pk"])} devices')
             else:
@@ -469,7 +494,7 @@ class ServiceDetach(PermissionRequiredMixin, View):
                 
         ServiceMapping.objects.filter(device__in=selected_devices).delete()
         Compliance.objects.filter(device__in=selected_devices).delete()
-        get_queue("default").enqueue("config_officer.worker.upload_compliance_status_into_influxdb")
+        get_job_queue("compliance").enqueue("config_officer.worker.upload_compliance_status_into_influxdb")
         messages.success(request, f'{len(selected_devices)} devices were de-attached from service.')
         return redirect(reverse('plugins:config_officer:service_mapping_list'))        
 
@@ -485,5 +510,44 @@ def running_config(request, hostname):
     else:
         message["status"] = True
         message["running_config"] = running_config
-    message["repo_state"] = get_file_repo_state(NETBOX_DEVICES_CONFIGS_DIR, f"{hostname}_running.txt")
-    return render(request, "config_officer/device_running_config.html", {"message": message})
\ No newline at end of file
+
+    # Changes history is read from ConfigChange index. Older pages and diffs are fetched by the page while scrolling.
+    changes = ConfigChange.objects.for_hostname(hostname).filter(config_type="running")
+    page = Paginator(changes, CONFIG_CHANGES_PAGE_SIZE).get_page(request.GET.get("page"))
+    if request.GET.get("partial"):
+        return render(request, "config_officer/device_config_changes.html", {"hostname": hostname, "changes": page})
+
+    message["repo_state"] = changes.aggregate(
+        commits_count=Count("pk"), first_commit_date=Min("date"), last_commit_date=Max("date")
+    )
+    message["changes"] = page
+    return render(request, "config_officer/device_running_config.html", {"message": message, "hostname": hostname})
+
+
+class ConfigChangeListView(PermissionRequiredMixin, ObjectListView):
+    """Fleet-wide feed of device config changes."""
+
+    permission_required = ('dcim.view_site', 'dcim.view_device')
+    queryset = ConfigChange.objects.select_related("device__site", "device__device_role", "device__tenant", "run")
+    filterset = ConfigChangeFilter
+    filterset_form = ConfigChangeFilterForm
+    table = ConfigChangeTable
+    action_buttons = ()
+
+
+def config_diff(request, hostname, commit):
+    """Diff of device running config made by one commit."""
+
+    # Only indexed commits are looked up in git
+    change = ConfigChange.objects.for_hostname(hostname).filter(config_type="running", commit=commit).first()
+    if not change:
+        raise Http404(f"No change of {hostname} in commit {commit}")
+    # Changes indexed before sharded layouts were introduced have no path, they were in repository root
+    filename = change.path or get_config_path(hostname, "running", layout="flat")
+    diff = DIFF_CACHE.get((commit, filename))
+    if diff is None:
+        diff = get_file_diff(NETBOX_DEVICES_CONFIGS_DIR, commit, filename)
+        if diff is None:
+            raise Http404(f"Commit {commit} not found in repository")
+        DIFF_CACHE.set((commit, filename), diff)
+    return HttpResponse(diff, content_type="text/plain; charset=utf-8")
\ No newline at end of file
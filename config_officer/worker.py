@@ -1,168 +1,742 @@
-from django_rq import job, get_queue
+from django_rq import job, get_connection, get_queue
+from rq import get_current_job
+from .queues import QUEUES, get_job_queue
 from dcim.models import Device
-from .models import Collection, Compliance, ServiceMapping
-from datetime import datetime
+from .models import Collection, CollectionRun, Compliance, ServiceMapping, DeviceCollectionState, ConfigChange
+from datetime import datetime, timedelta
 import time
+import asyncio
+from contextlib import contextmanager, asynccontextmanager, nullcontext
+from redis.exceptions import LockError
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.db import connection, transaction
 from .choices import CollectFailChoices, CollectStatusChoices
 import ipaddress
-from .collect import CollectDeviceData
+import os
+from .collect import CollectDeviceData, check_reachability_bulk, save_custom_fields, save_custom_fields_bulk
 from .custom_exceptions import CollectionException
-from django.db.models import Q
-from git import Repo
+from .limiter import (
+    COLLECTION_LIMIT_WAIT,
+    NoFreeSlot,
+    get_device_semaphore,
+    get_group_limit,
+    get_limit_group,
+    interleave_by_limit_group,
+)
+from django.db.models import Count, F, Q
+from django.db.models.functions import Lower
+from git import Repo, GitCommandError
 from .choices import ServiceComplianceChoices
-from .git_manager import get_device_config, get_days_after_update
+from .git_manager import (
+    get_device_config,
+    get_days_after_update,
+    get_commits_numstat,
+    parse_config_filename,
+    RESHARD_COMMIT_MESSAGE,
+)
 from .config_manager import get_config_diff
 from django.conf import settings
+from django.utils import timezone
 
 PLUGIN_SETTINGS = settings.PLUGINS_CONFIG.get("config_officer", dict())
 CF_NAME_COLLECTION_STATUS = PLUGIN_SETTINGS.get("CF_NAME_COLLECTION_STATUS", "collection_status")
 NETBOX_DEVICES_CONFIGS_DIR = PLUGIN_SETTINGS.get("NETBOX_DEVICES_CONFIGS_DIR", "/device_configs")
+# "job" - one RQ job per device,
+# "chunked" - one RQ job per COLLECTION_CHUNK_SIZE devices, collected by COLLECTION_CHUNK_THREADS threads,
+# "asyncio" - all devices are collected concurrently by a single job.
+COLLECTION_MODE = PLUGIN_SETTINGS.get("COLLECTION_MODE", "job")
+COLLECTION_CHUNK_SIZE = PLUGIN_SETTINGS.get("COLLECTION_CHUNK_SIZE", 50)
+COLLECTION_CHUNK_THREADS = PLUGIN_SETTINGS.get("COLLECTION_CHUNK_THREADS", 10)
+ASYNC_COLLECTION_CONCURRENCY = PLUGIN_SETTINGS.get("ASYNC_COLLECTION_CONCURRENCY", 100)
+COLLECTION_JOB_TIMEOUT = PLUGIN_SETTINGS.get("COLLECTION_JOB_TIMEOUT", 6 * 3600)
+# Max time of one device collection session. Another session to the device waits no longer than that.
+DEVICE_LOCK_TIMEOUT = PLUGIN_SETTINGS.get("DEVICE_LOCK_TIMEOUT", 600)
+# Slot of the device group is taken first and held while waiting for the device lock and collecting the device
+DEVICE_SLOT_TIMEOUT = 2 * DEVICE_LOCK_TIMEOUT
+# Per device job waits for the device lock, then collects the device. It does not wait for a slot of the device group,
+# the job is deferred to the back of the queue instead
+DEVICE_JOB_TIMEOUT = 2 * DEVICE_LOCK_TIMEOUT
+REACHABILITY_PRECHECK = PLUGIN_SETTINGS.get("REACHABILITY_PRECHECK", True)
+# Collection history retention, None disables the limit
+COLLECTION_RETENTION_DAYS = PLUGIN_SETTINGS.get("COLLECTION_RETENTION_DAYS", 30)
+COLLECTION_RETENTION_RUNS = PLUGIN_SETTINGS.get("COLLECTION_RETENTION_RUNS", None)
+if COLLECTION_RETENTION_RUNS is not None:
+    # The latest run is shown on collection status page
+    COLLECTION_RETENTION_RUNS = max(1, COLLECTION_RETENTION_RUNS)
 GLOBAL_TASK_INIT_MESSAGE = 'global_collection_task'
 DEFAULT_PLATFORM = 'iosxe'
+BULK_BATCH_SIZE = 1000
+# Max paths passed to one git command
+GIT_PATHS_BATCH_SIZE = 500
+# Collection fields changed by collection, saved in bulk in chunked mode
+COLLECT_TASK_RESULT_FIELDS = [
+    "status",
+    "failed_reason",
+    "message",
+    "login_count",
+    "login_time_saved",
+    "config_changed",
+    "parse_time",
+]
 
-def get_active_collect_task_count():
-    """ Get count of pending collection tasks."""
-    return  Collection.objects.filter((Q(status__iexact=CollectStatusChoices.STATUS_PENDING)
-            | Q(status__iexact=CollectStatusChoices.STATUS_RUNNING)) & Q(message__iexact=GLOBAL_TASK_INIT_MESSAGE)).count()
 
+def get_written_files_key(commit_msg):
+    return f"config_officer_written_files_{commit_msg}"
 
-@job("default")
+
+def record_written_files(commit_msg, filenames):
+    """Remember config files written by collection, git_commit_configs_changes stages only them."""
+
+    if filenames:
+        key = get_written_files_key(commit_msg)
+        pipe = get_connection(QUEUES["git"]).pipeline()
+        pipe.sadd(key, *[os.path.relpath(filename, NETBOX_DEVICES_CONFIGS_DIR) for filename in filenames])
+        pipe.expire(key, COLLECTION_JOB_TIMEOUT * 2)
+        pipe.execute()
+
+
+# Files of failed commits, staged by the next commit of any collection
+UNCOMMITTED_FILES_KEY = "config_officer_written_files_uncommitted"
+
+
+def get_written_files(commit_msg):
+    """Get config files written for the commit and left by failed commits.
+    They are kept until the commit succeeds."""
+
+    connection = get_connection(QUEUES["git"])
+    filenames = connection.sunion(get_written_files_key(commit_msg), UNCOMMITTED_FILES_KEY)
+    return sorted(filename.decode() for filename in filenames)
+
+
+def forget_written_files(commit_msg, filenames):
+    """Forget committed files. Files recorded by a session finished during the commit are kept."""
+
+    if filenames:
+        pipe = get_connection(QUEUES["git"]).pipeline()
+        pipe.srem(get_written_files_key(commit_msg), *filenames)
+        pipe.srem(UNCOMMITTED_FILES_KEY, *filenames)
+        pipe.execute()
+
+
+def keep_uncommitted_files(commit_msg):
+    """Pass files of the failed commit to the next commit, as the commit message key expires."""
+
+    key = get_written_files_key(commit_msg)
+    pipe = get_connection(QUEUES["git"]).pipeline()
+    pipe.sunionstore(UNCOMMITTED_FILES_KEY, UNCOMMITTED_FILES_KEY, key)
+    pipe.delete(key)
+    pipe.execute()
+
+
+def update_collection_run(run_id, **deltas):
+    """Change collection run counters atomically with F() expressions."""
+    if run_id:
+        CollectionRun.objects.filter(pk=run_id).update(**{k: F(k) + v for k, v in deltas.items()})
+
+
+def complete_collect_tasks(run_id, commit_msg, succeeded=0, failed=0):
+    """Move finished tasks from running to succeeded/failed counters of collection run.
+    Git commit is enqueued exactly once - by the call that finishes the run.
+    Tasks out of global run (run_id is None) are committed right away."""
+
+    if run_id is None:
+        get_job_queue("git").enqueue("config_officer.worker.git_commit_configs_changes", commit_msg)
+        return
+    update_collection_run(run_id, running=-(succeeded + failed), succeeded=succeeded, failed=failed)
+    finished = CollectionRun.objects.filter(
+        pk=run_id, pending__lte=0, running__lte=0, finished__isnull=True
+    ).update(finished=timezone.now())
+    if finished:
+        get_job_queue("git").enqueue("config_officer.worker.git_commit_configs_changes", commit_msg)
+
+
+@job(QUEUES["git"])
+def finalize_expired_runs():
+    """Finish runs older than COLLECTION_JOB_TIMEOUT. A killed or timed out job never moves its tasks
+    out of pending/running counters, so such run is never finished by complete_collect_tasks.
+    Unfinished tasks are failed, counters are recounted from tasks and collected configs are committed."""
+
+    deadline = timezone.now() - timedelta(seconds=COLLECTION_JOB_TIMEOUT)
+    for run in CollectionRun.objects.filter(finished__isnull=True, started__lt=deadline):
+        run.tasks.filter(
+            status__in=[CollectStatusChoices.STATUS_PENDING, CollectStatusChoices.STATUS_RUNNING]
+        ).update(
+            status=CollectStatusChoices.STATUS_FAILED,
+            failed_reason=CollectFailChoices.FAIL_GENERAL,
+            message="Collection job was killed or timed out",
+        )
+        counts = dict(run.tasks.values_list("status").annotate(Count("pk")).order_by())
+        # Run may be finished by the last job meanwhile, it is committed then
+        finished = CollectionRun.objects.filter(pk=run.pk, finished__isnull=True).update(
+            finished=timezone.now(),
+            pending=0,
+            running=0,
+            succeeded=counts.get(CollectStatusChoices.STATUS_SUCCEEDED, 0),
+            failed=counts.get(CollectStatusChoices.STATUS_FAILED, 0),
+        )
+        if finished and run.commit_msg:
+            get_job_queue("git").enqueue("config_officer.worker.git_commit_configs_changes", run.commit_msg)
+
+
+def get_device_lock(device_id):
+    """Redis lock which allows one collection session per device across all workers."""
+    return get_connection(QUEUES["collection"]).lock(
+        f"config_officer_collect_device_{device_id}", timeout=DEVICE_LOCK_TIMEOUT
+    )
+
+
+def device_lock_exception():
+    return CollectionException(
+        reason=CollectFailChoices.FAIL_GENERAL,
+        message=f"Device is collected by another job for more than {DEVICE_LOCK_TIMEOUT} seconds",
+    )
+
+
+@contextmanager
+def device_collection_lock(device_id):
+    """Wait until other sessions to the device are finished."""
+
+    lock = get_device_lock(device_id)
+    if not lock.acquire(blocking_timeout=DEVICE_LOCK_TIMEOUT):
+        raise device_lock_exception()
+    try:
+        yield
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            # Lock expired and may be held by another session already
+            pass
+
+
+@asynccontextmanager
+async def device_collection_lock_async(device_id):
+    """Wait until other sessions to the device are finished, without blocking event loop."""
+
+    lock = get_device_lock(device_id)
+    deadline = time.monotonic() + DEVICE_LOCK_TIMEOUT
+    while not await sync_to_async(lock.acquire)(blocking=False):
+        if time.monotonic() > deadline:
+            raise device_lock_exception()
+        await asyncio.sleep(1)
+    try:
+        yield
+    finally:
+        try:
+            await sync_to_async(lock.release)()
+        except LockError:
+            pass
+
+
+def limit_exception():
+    return CollectionException(
+        reason=CollectFailChoices.FAIL_GENERAL,
+        message=f"No free collection slot of the device group for {COLLECTION_LIMIT_WAIT} seconds",
+    )
+
+
+def take_device_collection_slot(device):
+    """Take a concurrency slot of the device site, region or custom field group without waiting.
+    Returns context manager releasing the slot. Raises NoFreeSlot if all slots of the group are taken."""
+
+    semaphore = get_device_semaphore(get_connection(QUEUES["collection"]), device, DEVICE_SLOT_TIMEOUT)
+    if semaphore is None:
+        return nullcontext()
+    if not semaphore.acquire():
+        raise NoFreeSlot()
+    return semaphore
+
+
+def get_limit_deadline(limit_deadline=None):
+    """Time (epoch) after which collection waiting for a slot of the device group is failed."""
+    return limit_deadline or time.time() + COLLECTION_LIMIT_WAIT
+
+
+def defer_collection(func, *args, limit_deadline, job_timeout):
+    """Put collection without a free slot of the device group to the back of the queue of the current job.
+    Worker is free to collect devices of other groups meanwhile."""
+
+    current_job = get_current_job()
+    queue = get_queue(current_job.origin) if current_job else get_job_queue("collection")
+    if not queue.count:
+        # Only deferred collections are left, don't spin
+        time.sleep(1)
+    queue.enqueue(func, *args, limit_deadline=limit_deadline, job_timeout=job_timeout)
+
+
+@asynccontextmanager
+async def device_collection_slot_async(device, group_semaphores, deadline):
+    """Wait for a free concurrency slot of the device group, without blocking event loop.
+    Collections of the same group within the job wait on a local semaphore, only those that could
+    take a slot poll redis. Device site and region must be fetched in advance."""
+
+    group = get_limit_group(device)
+    if group is None:
+        yield
+        return
+    if group not in group_semaphores:
+        group_semaphores[group] = asyncio.Semaphore(get_group_limit(group))
+    async with group_semaphores[group]:
+        while True:
+            try:
+                slot = await sync_to_async(take_device_collection_slot)(device)
+                break
+            except NoFreeSlot:
+                # Slots are taken by other workers
+                if time.time() > deadline:
+                    raise limit_exception()
+                await asyncio.sleep(1)
+        try:
+            yield
+        finally:
+            await sync_to_async(slot.release)()
+
+
+def request_device_collection(device):
+    """Create collection task for the device unless the same collection is already in flight.
+
+    Pending task out of global run has not connected to the device yet - the request is attached to it.
+    Running task may have fetched the config before the request - a single follow-up task is created,
+    it waits for the device lock held by the running task. Returns (task, created).
+    """
+
+    stale = timezone.now() - timedelta(seconds=DEVICE_LOCK_TIMEOUT)
+    with transaction.atomic():
+        # Concurrent requests for the same device are serialized on the device row
+        Device.objects.select_for_update().filter(pk=device.pk).exists()
+        in_flight = Collection.objects.filter(device=device, timestamp__gte=stale)
+        collect_task = in_flight.filter(run__isnull=True, status=CollectStatusChoices.STATUS_PENDING).first()
+        if collect_task:
+            return collect_task, False
+        if in_flight.filter(status=CollectStatusChoices.STATUS_RUNNING).exists():
+            message = "device follow-up collection task"
+        else:
+            message = "device collection task"
+        collect_task = Collection.objects.create(device=device, message=message)
+
+    now = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+    commit_msg = f"device_{device.name}_{now}"
+    get_job_queue("interactive").enqueue(
+        "config_officer.worker.collect_device_config_task",
+        collect_task.pk,
+        commit_msg,
+        job_timeout=DEVICE_JOB_TIMEOUT,
+        at_front=True,
+    )
+    return collect_task, True
+
+
+@job(QUEUES["interactive"])
 def collect_device_config_hostname(hostname):
     """Collect device configuration by name. Task started with hostname param."""
 
     device = Device.objects.get(name__iexact=hostname)
-    collect_task = Collection.objects.create(device=device, message="device collection task")
-    collect_task.save()
+    collect_task, created = request_device_collection(device)
+    if not created:
+        return f"{hostname} collection is already pending, attached to task {collect_task.pk}."
+    return f"{hostname} collection task {collect_task.pk} was started."
 
-    now = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-    commit_msg = f"device_{hostname}_{now}"      
-    get_queue("default").enqueue("config_officer.worker.collect_device_config_task", collect_task.pk, commit_msg)
+
+def start_collect_task(collect_task, save=True):
+    """Mark collection task as running and prepare collector for its device."""
+
+    collect_task.status = CollectStatusChoices.STATUS_RUNNING
+    if save:
+        collect_task.save()
+
+    device_netbox = collect_task.device
+    platform = device_netbox.platform.name
+    if platform is None:
+        platform = DEFAULT_PLATFORM
+    ip = str(ipaddress.ip_interface(device_netbox.primary_ip4).ip)
+    return CollectDeviceData(collect_task,
+                            ip=ip,
+                            hostname_ipam=str(device_netbox.name),
+                            platform=platform
+                        )
+
+
+def fail_collect_task(collect_task, exc, device_collect=None, save=True):
+    """Save collection task failure and buffered custom fields."""
+
+    if device_collect:
+        device_collect.update_custom_field(CF_NAME_COLLECTION_STATUS, False)
+        device_collect.flush_custom_fields()
+    elif collect_task.device:
+        save_custom_fields(collect_task.device, {CF_NAME_COLLECTION_STATUS: False})
+
+    collect_task.status = CollectStatusChoices.STATUS_FAILED
+    if isinstance(exc, CollectionException):
+        collect_task.failed_reason = exc.reason
+        collect_task.message = exc.message
+    else:
+        collect_task.failed_reason = CollectFailChoices.FAIL_GENERAL
+        collect_task.message = f"Unknown error {exc}"
+    if save:
+        collect_task.save()
+
+
+def succeed_collect_task(collect_task, device_collect, save=True):
+    """Save collection task success, buffered custom fields and check compliance."""
+
+    device_collect.update_custom_field(CF_NAME_COLLECTION_STATUS, True)
+    device_collect.flush_custom_fields()
+    collect_task.status = CollectStatusChoices.STATUS_SUCCEEDED
+    if save:
+        collect_task.save()
+
+    # Unchanged config - compliance is the same, unless it was not evaluated last time
+    if not collect_task.config_changed and Compliance.objects.filter(device=collect_task.device, notes__isnull=True).exists():
+        return
+
+    try:
+        get_job_queue("compliance").enqueue("config_officer.worker.check_device_config_compliance", device_id=collect_task.device_id)
+    except:
+        pass
 
 
-@job("default")
-def collect_device_config_task(task_id, commit_msg=""):
-    """Worker - collect a particular device."""
+@job(QUEUES["collection"])
+def collect_device_config_task(task_id, commit_msg="", check_reachability=True, limit_deadline=None):
+    """Worker - collect a particular device. Collection is deferred while the device group has no free slot."""
 
-    # Get collection task by pk. If not found - wait a little.
-    time.sleep(1)
+    # Get collection task by pk. If not found - wait a little. Deferred task exists for sure.
+    if limit_deadline is None:
+        time.sleep(1)
     try:
         collect_task = Collection.objects.get(id=task_id)
     except Collection.DoesNotExist:
         time.sleep(5)
         collect_task = Collection.objects.get(id=task_id)
 
-    collect_task.status = CollectStatusChoices.STATUS_RUNNING
-    collect_task.save()
-
     if not (commit_msg):
         now = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
         commit_msg = f"{now}"
 
-    # If needed to fill custom fields
+    limit_deadline = get_limit_deadline(limit_deadline)
     try:
-        device_netbox = collect_task.device
-        device_netbox.custom_field_data[CF_NAME_COLLECTION_STATUS] = False
-        platform = device_netbox.platform.name
-        if platform is None:
-            platform = DEFAULT_PLATFORM
-        device_netbox.save()
-        ip = str(ipaddress.ip_interface(device_netbox.primary_ip4).ip)
-        device_collect = CollectDeviceData(collect_task,
-                                            ip=ip,
-                                            hostname_ipam=str(device_netbox.name),
-                                            platform=platform
-                                        )
-        device_collect.collect_information()
-    except CollectionException as exc:
-        collect_task.status = CollectStatusChoices.STATUS_FAILED
-        collect_task.failed_reason = exc.reason
-        collect_task.message = exc.message
-        collect_task.save()
-        if get_active_collect_task_count() < 11:    
-            get_queue("default").enqueue("config_officer.worker.git_commit_configs_changes", commit_msg)        
-        raise
+        slot = take_device_collection_slot(collect_task.device)
+    except NoFreeSlot:
+        if time.time() < limit_deadline:
+            defer_collection(
+                collect_device_config_task,
+                task_id,
+                commit_msg,
+                check_reachability,
+                limit_deadline=limit_deadline,
+                job_timeout=DEVICE_JOB_TIMEOUT,
+            )
+            return f"{collect_task.device.name} collection is deferred, no free slot of the device group."
+        slot = None
+
+    update_collection_run(collect_task.run_id, pending=-1, running=1)
+    device_collect = None
+    try:
+        device_collect = start_collect_task(collect_task)
+        if slot is None:
+            raise limit_exception()
+        with slot, device_collection_lock(collect_task.device_id):
+            device_collect.collect_information(check_reachability=check_reachability)
     except Exception as exc:
-        collect_task.status = CollectStatusChoices.STATUS_FAILED
-        collect_task.failed_reason = CollectFailChoices.FAIL_GENERAL
-        collect_task.message = f"Unknown error {exc}"
-        collect_task.save()
-        if get_active_collect_task_count() < 11:
-            get_queue("default").enqueue("config_officer.worker.git_commit_configs_changes", commit_msg)           
+        fail_collect_task(collect_task, exc, device_collect)
+        record_written_files(commit_msg, device_collect.written_files if device_collect else [])
+        complete_collect_tasks(collect_task.run_id, commit_msg, failed=1)
         raise
-    collect_task.status = CollectStatusChoices.STATUS_SUCCEEDED
-    device_netbox.custom_field_data[CF_NAME_COLLECTION_STATUS] = True
-    collect_task.save()
+    succeed_collect_task(collect_task, device_collect)
 
+    record_written_files(commit_msg, device_collect.written_files)
+    complete_collect_tasks(collect_task.run_id, commit_msg, succeeded=1)
+    return f"{collect_task.device.name} {device_collect.device['host']} running config was collected."
+
+
+def collect_device_config_in_thread(collect_task, check_reachability=True, limit_deadline=None):
+    """Collect a particular device within chunk thread pool. Collection task is not saved here.
+    Returns None if the device group has no free slot, the task is deferred by the chunk."""
+
+    device_collect = None
+    collect_task.written_files = []
     try:
-        get_queue("default").enqueue("config_officer.worker.check_device_config_compliance", device=collect_task.device)        
-    except:
-        pass
-        
-    if get_active_collect_task_count() < 11:
-        get_queue("default").enqueue("config_officer.worker.git_commit_configs_changes", commit_msg)       
-    return f"{collect_task.device.name} {ip} running config was collected."
+        slot = take_device_collection_slot(collect_task.device)
+    except NoFreeSlot:
+        if time.time() < limit_deadline:
+            connection.close()
+            return None
+        slot = None
+    try:
+        device_collect = start_collect_task(collect_task, save=False)
+        if slot is None:
+            raise limit_exception()
+        with slot, device_collection_lock(collect_task.device_id):
+            device_collect.collect_information(check_reachability=check_reachability)
+    except Exception as exc:
+        fail_collect_task(collect_task, exc, device_collect, save=False)
+        return False
+    else:
+        succeed_collect_task(collect_task, device_collect, save=False)
+        return True
+    finally:
+        collect_task.written_files = device_collect.written_files if device_collect else []
+        # Every thread has its own database connection
+        connection.close()
+
+
+@job(QUEUES["collection"])
+def collect_devices_config_chunk(task_ids, commit_msg="", check_reachability=True, limit_deadline=None):
+    """Worker - collect chunk of devices with thread pool. Collection tasks are updated in bulk.
+    Devices without a free slot of their group are deferred as a new chunk to the back of the queue."""
+
+    if not (commit_msg):
+        now = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+        commit_msg = f"{now}"
+
+    collect_tasks = list(
+        Collection.objects.filter(pk__in=task_ids).select_related("device__platform", "device__primary_ip4", "device__site__region")
+    )
+    Collection.objects.filter(pk__in=task_ids).update(status=CollectStatusChoices.STATUS_RUNNING)
+    run_id = collect_tasks[0].run_id if collect_tasks else None
+    update_collection_run(run_id, pending=-len(collect_tasks), running=len(collect_tasks))
+
+    limit_deadline = get_limit_deadline(limit_deadline)
+    with ThreadPoolExecutor(max_workers=COLLECTION_CHUNK_THREADS) as executor:
+        results = list(
+            executor.map(
+                lambda task: collect_device_config_in_thread(task, check_reachability, limit_deadline), collect_tasks
+            )
+        )
+
+    deferred = [task.pk for task, result in zip(collect_tasks, results) if result is None]
+    collect_tasks = [task for task, result in zip(collect_tasks, results) if result is not None]
+    if deferred:
+        Collection.objects.filter(pk__in=deferred).update(status=CollectStatusChoices.STATUS_PENDING)
+        update_collection_run(run_id, pending=len(deferred), running=-len(deferred))
+        defer_collection(
+            collect_devices_config_chunk,
+            deferred,
+            commit_msg,
+            check_reachability,
+            limit_deadline=limit_deadline,
+            job_timeout=COLLECTION_JOB_TIMEOUT,
+        )
+
+    Collection.objects.bulk_update(collect_tasks, COLLECT_TASK_RESULT_FIELDS)
+    record_written_files(commit_msg, [filename for task in collect_tasks for filename in task.written_files])
+
+    complete_collect_tasks(run_id, commit_msg, succeeded=results.count(True), failed=results.count(False))
+    return f"{results.count(True)} of {len(collect_tasks)} devices running configs were collected."
+
+
+async def collect_device_config_async(task_id, semaphore, group_semaphores, commit_msg, check_reachability=True):
+    """Collect a particular device within asyncio event loop.
+    Slot of the device group is taken before the job-wide concurrency permit, so collections waiting
+    for a busy group do not hold permits needed by devices of other groups."""
+
+    collect_task = await sync_to_async(Collection.objects.select_related("device__platform", "device__site__region").get)(id=task_id)
+    try:
+        async with device_collection_slot_async(collect_task.device, group_semaphores, get_limit_deadline()):
+            async with semaphore:
+                return await collect_task_async(collect_task, commit_msg, check_reachability)
+    except CollectionException as exc:
+        # No free slot of the device group for COLLECTION_LIMIT_WAIT
+        async with semaphore:
+            return await collect_task_async(collect_task, commit_msg, check_reachability, exc)
+
 
+async def collect_task_async(collect_task, commit_msg, check_reachability=True, slot_exc=None):
+    """Collect the device of collection task, or fail it with slot_exc."""
 
-@job("default")
+    await sync_to_async(update_collection_run)(collect_task.run_id, pending=-1, running=1)
+    device_collect = None
+    try:
+        device_collect = await sync_to_async(start_collect_task)(collect_task)
+        if slot_exc:
+            raise slot_exc
+        async with device_collection_lock_async(collect_task.device_id):
+            await device_collect.collect_information_async(check_reachability=check_reachability)
+    except Exception as exc:
+        await sync_to_async(fail_collect_task)(collect_task, exc, device_collect)
+        await sync_to_async(record_written_files)(commit_msg, device_collect.written_files if device_collect else [])
+        await sync_to_async(complete_collect_tasks)(collect_task.run_id, commit_msg, failed=1)
+        return False
+    await sync_to_async(succeed_collect_task)(collect_task, device_collect)
+    await sync_to_async(record_written_files)(commit_msg, device_collect.written_files)
+    await sync_to_async(complete_collect_tasks)(collect_task.run_id, commit_msg, succeeded=1)
+    return True
+
+
+async def collect_devices_configs_async(task_ids, commit_msg, check_reachability=True):
+    """Collect devices concurrently, no more than ASYNC_COLLECTION_CONCURRENCY sessions at a time
+    and no more than the limit of every device group."""
+
+    semaphore = asyncio.Semaphore(ASYNC_COLLECTION_CONCURRENCY)
+    group_semaphores = {}
+    return await asyncio.gather(
+        *[
+            collect_device_config_async(task_id, semaphore, group_semaphores, commit_msg, check_reachability)
+            for task_id in task_ids
+        ]
+    )
+
+
+@job(QUEUES["collection"])
+def collect_devices_config_task_async(task_ids, commit_msg="", check_reachability=True):
+    """Worker - collect list of devices with asyncio scrapli drivers."""
+
+    if not (commit_msg):
+        now = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+        commit_msg = f"{now}"
+
+    results = asyncio.run(collect_devices_configs_async(task_ids, commit_msg, check_reachability))
+    return f"{results.count(True)} of {len(task_ids)} devices running configs were collected."
+
+
+@job(QUEUES["git"])
 def git_commit_configs_changes(msg):
     """Commit changes in devices show-run."""
 
-    if get_active_collect_task_count() > 0:
-        return    
     message = ""
     try:
         repo = Repo(NETBOX_DEVICES_CONFIGS_DIR)
-        repo.git.add("*")
+        # Only files written by the collection are staged, the rest of the tree is not scanned
+        filenames = get_written_files(msg)
+        for i in range(0, len(filenames), GIT_PATHS_BATCH_SIZE):
+            batch = filenames[i:i + GIT_PATHS_BATCH_SIZE]
+            existing = [f for f in batch if os.path.exists(os.path.join(NETBOX_DEVICES_CONFIGS_DIR, f))]
+            removed = [f for f in batch if f not in existing]
+            if existing:
+                repo.git.add("--", *existing)
+            if removed:
+                # Files moved to another path of the layout
+                repo.git.rm("--cached", "--ignore-unmatch", "-q", "--", *removed)
 
-        # check if there are any changes
-        if len(repo.index.diff("HEAD")) > 0:
+        # check if there are any changes. Files staged by a failed commit before are committed as well.
+        if repo.git.diff("--cached", "--name-only"):
             commit_hash = repo.git.commit("-m", msg, author="Netbox Netbox <netbox@example.com>")
-            message = f"Commited. Response={commit_hash}."
+            forget_written_files(msg, filenames)
+            message = f"Commited. Response={commit_hash}. {index_config_changes()} config changes indexed."
         else:
+            forget_written_files(msg, filenames)
             message = "No changes for commit"
     except Exception as e:
+        # Files stay recorded and are staged again by the next commit
+        keep_uncommitted_files(msg)
         message = e
     return message
 
 
-@job("default")
-def check_device_config_compliance(device):
+def get_devices_by_hostname(hostnames):
+    """Device ids by config file hostnames. File name case may differ from the device name,
+    exact name match is preferred."""
+
+    devices = Device.objects.annotate(name_lower=Lower("name")).filter(
+        name_lower__in={hostname.lower() for hostname in hostnames}
+    )
+    exact, lower = {}, {}
+    for name, pk in devices.values_list("name", "pk"):
+        exact[name] = pk
+        lower.setdefault(name.lower(), pk)
+    return {hostname: exact.get(hostname, lower.get(hostname.lower())) for hostname in hostnames}
+
+
+def index_config_changes(full=False):
+    """Add changes of device config files made by commits after the last indexed one to ConfigChange index.
+    The first call (or full=True) indexes the whole repository history, indexed changes are skipped."""
+
+    last_change = None if full else ConfigChange.objects.first()
+    try:
+        commits = get_commits_numstat(NETBOX_DEVICES_CONFIGS_DIR, since=last_change.commit if last_change else None)
+    except GitCommandError:
+        # Last indexed commit is not in repository anymore
+        commits = get_commits_numstat(NETBOX_DEVICES_CONFIGS_DIR)
+
+    changes = {}
+    for commit in commits:
+        if commit["msg"] == RESHARD_COMMIT_MESSAGE:
+            continue
+        for filename, added, deleted in commit["files"]:
+            parsed = parse_config_filename(filename)
+            if not parsed:
+                continue
+            key = (commit["hash"], *parsed)
+            change = changes.get(key)
+            if change:
+                # Old path deleted and new path added by one commit, too different to be detected as a rename
+                if not change.added:
+                    change.path = filename
+                change.added += added
+                change.deleted += deleted
+                continue
+            changes[key] = ConfigChange(
+                hostname=parsed[0],
+                config_type=parsed[1],
+                path=filename,
+                commit=commit["hash"],
+                date=commit["date"],
+                message=commit["msg"][:512],
+                added=added,
+                deleted=deleted,
+            )
+    changes = list(changes.values())
+    devices = get_devices_by_hostname({change.hostname for change in changes})
+    # Global collection runs commit with their commit_msg
+    runs = dict(
+        CollectionRun.objects.filter(commit_msg__in={commit["msg"] for commit in commits}).values_list("commit_msg", "pk")
+    )
+    for change in changes:
+        change.device_id = devices.get(change.hostname)
+        change.run_id = runs.get(change.message)
+    ConfigChange.objects.bulk_create(changes, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+    return len(changes)
+
+
+def get_device_config_age(device):
+    """Get days after last successful collection. Unchanged config file is not rewritten, so its ctime is not enough."""
+    state = DeviceCollectionState.objects.filter(device=device, last_collected__isnull=False).first()
+    if state:
+        return round((timezone.now() - state.last_collected).total_seconds() / 86400)
+    return get_days_after_update(NETBOX_DEVICES_CONFIGS_DIR, device.name, "running", site=device.site.slug)
+
+
+@job(QUEUES["compliance"])
+def check_device_config_compliance(device_id):
     
     """Check a configuration template compliance for a particular device.""" 
 
-    # Compliance.objects.get_or_create(device=device).delete()    
+    # Device is fetched by the job, so it is up to date and is not pickled into redis with the job
+    device = Device.objects.select_related("device_role", "device_type", "site").get(pk=device_id)
     compliance = Compliance.objects.get_or_create(device=device)[0]
+    # Existing compliance is fetched without the device, templates are matched against the one with related objects
+    compliance.device = device
     compliance.status = ServiceComplianceChoices.STATUS_NON_COMPLIANCE
     compliance.notes = "not checked yet"
     compliance.generated_config = "None"
     compliance.diff = "None"
     compliance.save()
-    compliance.services = [m.service.name for m in ServiceMapping.objects.filter(device=compliance.device)]
+    compliance.services = [m.service.name for m in ServiceMapping.objects.filter(device=device).select_related("service")]
 
     # Check if there are matched templates
     templates = compliance.get_device_templates()
     if not templates:
         compliance.notes = 'No matched templates'
         compliance.save()   
-        return {device: compliance.notes}    
+        return {device.name: compliance.notes}    
 
     # Check if device config file exists: 
-    device_config = get_device_config(NETBOX_DEVICES_CONFIGS_DIR, device.name, "running")        
+    device_config = get_device_config(NETBOX_DEVICES_CONFIGS_DIR, device.name, "running", site=device.site.slug)        
     if not device_config:
         compliance.notes = 'running config not found in git'
         compliance.save()
-        return {device: compliance.notes}
+        return {device.name: compliance.notes}
 
     # If device configuration elder tham 7 days - non_compliance
-    device_config_age = get_days_after_update(NETBOX_DEVICES_CONFIGS_DIR, device.name, "running")       
+    device_config_age = get_device_config_age(device)
     if device_config_age > 7:    
         compliance.notes = f"device config is staled ({device_config_age} days)"
         compliance.save()
-        return {device: compliance.notes}
+        return {device.name: compliance.notes}
     elif device_config_age < 0:
         compliance.notes = 'unknown error during calculating config age',
         compliance.save()
-        return {device: compliance.notes}
+        return {device.name: compliance.notes}
 
     generated_config = compliance.get_generated_config().splitlines()
     
@@ -180,19 +754,142 @@ def check_device_config_compliance(device):
         compliance.status = ServiceComplianceChoices.STATUS_NON_COMPLIANCE
     compliance.save()
 
-    return {device: compliance.status}
+    return {device.name: compliance.status}
+
+
+def delete_in_batches(queryset):
+    """Delete queryset BULK_BATCH_SIZE rows at a time to keep transactions and locks short."""
+
+    deleted = 0
+    while True:
+        pks = list(queryset.values_list("pk", flat=True)[:BULK_BATCH_SIZE])
+        if not pks:
+            return deleted
+        deleted += queryset.model.objects.filter(pk__in=pks).delete()[0]
+
+
+@job(QUEUES["maintenance"])
+def prune_collection_history():
+    """Worker - delete collection tasks and runs out of retention policy. Active runs and their tasks are kept."""
+
+    deleted = 0
+    active_run_ids = list(CollectionRun.objects.filter(finished__isnull=True).values_list("pk", flat=True))
+    runs = CollectionRun.objects.exclude(pk__in=active_run_ids)
+    stale_runs = CollectionRun.objects.none()
+    if COLLECTION_RETENTION_DAYS is not None:
+        cutoff = timezone.now() - timedelta(days=COLLECTION_RETENTION_DAYS)
+        stale_runs = stale_runs | runs.filter(started__lt=cutoff)
+        deleted += delete_in_batches(
+            Collection.objects.filter(timestamp__lt=cutoff).exclude(run__in=active_run_ids)
+        )
+    if COLLECTION_RETENTION_RUNS is not None:
+        kept_runs = CollectionRun.objects.order_by("-started").values_list("pk", flat=True)[:COLLECTION_RETENTION_RUNS]
+        stale_runs = stale_runs | runs.exclude(pk__in=list(kept_runs))
+    stale_run_ids = list(stale_runs.values_list("pk", flat=True))
 
+    # Tasks are deleted before their runs, so run deletion does not cascade into one large delete
+    deleted += delete_in_batches(Collection.objects.filter(run__in=stale_run_ids))
+    delete_in_batches(CollectionRun.objects.filter(pk__in=stale_run_ids))
+    return f"{deleted} collection tasks of {len(stale_run_ids)} runs deleted"
 
-@job("default")
-def collect_all_devices_configs():
+
+@job(QUEUES["collection"])
+def collect_all_devices_configs(run_id=None):
     """Worker - collect show-run configs from all devices."""
     # commit changes before the global collection
 
-    Collection.objects.all().delete()
-    devices = Device.objects.all()
+    finalize_expired_runs()
+    get_job_queue("maintenance").enqueue("config_officer.worker.prune_collection_history", at_front=True)
     now = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-    commit_msg = f"global_{now}"      
-    for device in devices:
-        collect_task = Collection.objects.create(device=device, message=GLOBAL_TASK_INIT_MESSAGE)
-        collect_task.save()
-        get_queue("default").enqueue("config_officer.worker.collect_device_config_task", collect_task.pk, commit_msg)
+    commit_msg = f"global_{now}"
+    run = CollectionRun.objects.get(pk=run_id) if run_id else CollectionRun.objects.create()
+    run.commit_msg = commit_msg
+
+    # Devices without primary IP or platform can not be collected. They are failed at once.
+    # Platform names out of PLATFORMS are collected with the platform that worked last time or iosxe driver.
+    collectable = Q(primary_ip4__isnull=False) & Q(platform__isnull=False)
+    skipped = Collection.objects.bulk_create(
+        [
+            Collection(
+                run=run,
+                device=device,
+                status=CollectStatusChoices.STATUS_FAILED,
+                failed_reason=CollectFailChoices.FAIL_GENERAL,
+                message="Device has no primary IPv4 address or platform",
+            )
+            for device in Device.objects.exclude(collectable).only("pk")
+        ],
+        batch_size=BULK_BATCH_SIZE,
+    )
+    collect_tasks = Collection.objects.bulk_create(
+        [
+            Collection(run=run, device=device, message=GLOBAL_TASK_INIT_MESSAGE)
+            for device in Device.objects.filter(collectable).select_related("primary_ip4", "site__region")
+        ],
+        batch_size=BULK_BATCH_SIZE,
+    )
+
+    run.total = len(skipped) + len(collect_tasks)
+
+    # Probe all devices at once. Unreachable devices are failed in bulk without spending a worker on them.
+    # If devices can't be probed at once, every collection checks its device.
+    check_reachability = not REACHABILITY_PRECHECK
+    if REACHABILITY_PRECHECK:
+        hosts = {task.pk: str(ipaddress.ip_interface(task.device.primary_ip4).ip) for task in collect_tasks}
+        try:
+            reachable_hosts = check_reachability_bulk(set(hosts.values()))
+        except OSError:
+            reachable_hosts = set(hosts.values())
+            check_reachability = True
+        unreachable = {pk for pk, host in hosts.items() if host not in reachable_hosts}
+        Collection.objects.filter(pk__in=unreachable).update(
+            status=CollectStatusChoices.STATUS_FAILED,
+            failed_reason=CollectFailChoices.FAIL_CONNECT,
+            message="Device unreachable",
+        )
+        save_custom_fields_bulk(
+            [task.device for task in collect_tasks if task.pk in unreachable], {CF_NAME_COLLECTION_STATUS: False}
+        )
+        collect_tasks = [task for task in collect_tasks if task.pk not in unreachable]
+
+    # Run counters are set before any job can start to change them
+    run.failed = run.total - len(collect_tasks)
+    run.pending = len(collect_tasks)
+    if not collect_tasks:
+        run.finished = timezone.now()
+    run.save()
+
+    # Devices of one site are next to each other in name order. Interleaved, they don't take all workers
+    # (or a whole chunk) while waiting for slots of their group.
+    collect_tasks = interleave_by_limit_group(collect_tasks, lambda task: task.device)
+
+    # All jobs are enqueued within one redis pipeline
+    queue = get_job_queue("collection")
+    if COLLECTION_MODE == "chunked":
+        jobs = [
+            queue.prepare_data(
+                "config_officer.worker.collect_devices_config_chunk",
+                ([task.pk for task in collect_tasks[i:i + COLLECTION_CHUNK_SIZE]], commit_msg, check_reachability),
+                timeout=COLLECTION_JOB_TIMEOUT,
+            )
+            for i in range(0, len(collect_tasks), COLLECTION_CHUNK_SIZE)
+        ]
+    elif COLLECTION_MODE == "asyncio":
+        jobs = [
+            queue.prepare_data(
+                "config_officer.worker.collect_devices_config_task_async",
+                ([task.pk for task in collect_tasks], commit_msg, check_reachability),
+                timeout=COLLECTION_JOB_TIMEOUT,
+            )
+        ] if collect_tasks else []
+    else:
+        jobs = [
+            queue.prepare_data(
+                "config_officer.worker.collect_device_config_task",
+                (task.pk, commit_msg, check_reachability),
+                timeout=DEVICE_JOB_TIMEOUT,
+            )
+            for task in collect_tasks
+        ]
+    if jobs:
+        queue.enqueue_many(jobs)
@@ -16,11 +16,13 @@ setup(
     license="Apache 2.0",
     install_requires=[
         'diffios',
-        'scrapli',
+        'scrapli[textfsm]',
         'GitPython',
-        'PyDriller==1.15.3',
         'xlsxwriter',
     ],
+    extras_require={
+        'asyncio': ['scrapli[asyncssh]'],
+    },
     packages=find_packages(exclude=("tests",)),
     include_package_data=True,
     zip_safe=False,